@@ -1,41 +1,84 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+import startup  # first, so worker startup time includes every import below
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func, text
+from sqlalchemy.exc import IntegrityError
 from datetime import date, timedelta, datetime
 from typing import List, Optional
 from pydantic import BaseModel, field_validator, EmailStr
 from jose import JWTError, jwt
 import bcrypt
-import os
 from PIL import Image
 from PIL.ExifTags import TAGS
 import os
 import aiofiles
 import uuid
 import shutil
+import threading
+import time
 
-# Try to import OpenCV for face detection, but make it optional
-try:
-    import cv2
-    import numpy as np
-    CV2_AVAILABLE = True
-except ImportError:
-    CV2_AVAILABLE = False
-    print("Warning: OpenCV not available. Face detection will be skipped.")
-
+import logging_config
+import metrics
 import models
 import database
+import jobs
+import leaderboard
+import phash
+import profiling
+import ratelimit
+import upload_gc
+from jobs import UploadRejected
+
+logging_config.configure_logging()
+logger = logging_config.get_logger("app")
+
+# OpenCV/NumPy are heavy (hundreds of ms and tens of MB per worker), so they are
+# imported lazily on the first upload instead of at module load. Set
+# WARM_CV2=true to import them in a background thread once the worker is ready.
+CV2_AVAILABLE = True
+_cv2 = None
+_face_cascade = None
+_cv2_lock = threading.Lock()
+
+
+def get_cv2():
+    """Import OpenCV on first use. Returns the cv2 module or None if unavailable."""
+    global _cv2, _face_cascade, CV2_AVAILABLE
+    if _cv2 is not None or not CV2_AVAILABLE:
+        return _cv2
+    with _cv2_lock:
+        if _cv2 is None and CV2_AVAILABLE:
+            try:
+                import cv2
+                import numpy  # noqa: F401  (cv2 needs it; import cost is paid here)
+                _face_cascade = cv2.CascadeClassifier(
+                    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+                )
+                _cv2 = cv2
+            except ImportError:
+                CV2_AVAILABLE = False
+                logger.warning("OpenCV not available. Face detection will be skipped.")
+    return _cv2
+
 
-# Create all tables (only creates if they don't exist, doesn't alter existing tables)
-# For production, run migrations separately
+# orjson is optional; without it the fast path still skips re-validation but
+# serializes with the stdlib encoder
 try:
-    models.Base.metadata.create_all(bind=database.engine)
-except Exception as e:
-    print(f"Warning: Could not create tables: {e}")
-    print("If tables already exist, this is normal. Run migrate_db.py to update schema.")
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    import orjson  # noqa: F401  (ORJSONResponse imports it lazily at render time)
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+# List endpoints build their payloads from trusted DB rows, so by default they
+# bypass response_model re-validation and return a pre-rendered response.
+# Set FAST_JSON_RESPONSES=false to go through FastAPI's normal serialization.
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "true").lower() == "true"
+
 
 app = FastAPI(title="Workout Calendar API")
 
@@ -53,12 +96,114 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Bind a request id (from X-Request-ID or generated) to every log line of this request"""
+    tokens = logging_config.start_request(request.headers.get("x-request-id", "")[:128] or None)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = logging_config.current_request_id()
+        return response
+    finally:
+        logging_config.end_request(tokens)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Per-route latency histogram and in-flight gauge"""
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        # Label by route template (/api/workouts/{workout_date}), not the raw path,
+        # so label cardinality stays bounded
+        route = request.scope.get("route")
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status_code,
+        )
+
+
+async def profile_requests(request: Request, call_next):
+    """Sample stacks while this request runs if it asked for it (X-Profile) or was picked by the sample rate"""
+    profile = profiling.profile_for_request(
+        request.headers.get("x-profile"), f"{request.method} {request.url.path}"
+    )
+    if profile is None:
+        return await call_next(request)
+    token = profiling.sampler.begin(profile)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.sampler.end(token)
+        profile.add_request(time.perf_counter() - started)
+    response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+# Only installed when PROFILING_TOKEN is set, so it costs nothing otherwise
+if profiling.enabled():
+    app.middleware("http")(profile_requests)
+
+
+@app.on_event("startup")
+def on_startup():
+    """Report how long this worker took to become ready and what it costs in memory.
+
+    Schema creation is not done here; run `python migrate_db.py` as a release step.
+    """
+    if os.getenv("WARM_CV2", "false").lower() == "true":
+        threading.Thread(target=get_cv2, name="warm-cv2", daemon=True).start()
+    upload_jobs.start()
+    upload_collector.start()
+    startup.report_ready()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    upload_jobs.stop()
+    upload_collector.stop()
+
+metrics.register_db_pool(database.engine)
+for i, replica_engine in enumerate(database.replica_engines):
+    metrics.register_db_pool(replica_engine, name=f"replica{i}")
+
 # Security
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
+WORKOUT_EXISTS_MESSAGE = "Workout already marked for today. Delete it first to create a new one."
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Rate limits and admission control for the expensive endpoints: login/register
+# (bcrypt) are limited per client IP, uploads (image decode + face detection) per user.
+# All of them share one cap on how many run at once in this worker.
+auth_rate_limit = ratelimit.RateLimiter(
+    "auth",
+    per_minute=float(os.getenv("AUTH_RATE_PER_MINUTE", "10")),
+    burst=int(os.getenv("AUTH_RATE_BURST", "5")),
+)
+upload_rate_limit = ratelimit.RateLimiter(
+    "upload",
+    per_minute=float(os.getenv("UPLOAD_RATE_PER_MINUTE", "6")),
+    burst=int(os.getenv("UPLOAD_RATE_BURST", "3")),
+)
+expensive_ops = ratelimit.ConcurrencyLimiter(
+    "expensive",
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_EXPENSIVE", "4")),
+)
 
 def get_db():
     db = database.SessionLocal()
@@ -68,6 +213,22 @@ def get_db():
         db.close()
 
 
+def get_read_db(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Session for read-only endpoints: a replica when configured, else the primary"""
+    user_id = None
+    if credentials is not None:
+        try:
+            # Only used to decide replica vs primary; the token is verified by get_current_user_read
+            user_id = jwt.get_unverified_claims(credentials.credentials).get("sub")
+        except JWTError:
+            pass
+    db = database.read_session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a bcrypt hash"""
     try:
@@ -99,6 +260,18 @@ def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> models.User:
+    return load_user_from_token(credentials, db)
+
+
+def get_current_user_read(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_read_db)
+) -> models.User:
+    """Same as get_current_user, but for read-only endpoints (may use a replica)"""
+    return load_user_from_token(credentials, db)
+
+
+def load_user_from_token(credentials: HTTPAuthorizationCredentials, db: Session) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -114,11 +287,20 @@ def get_current_user(
         raise credentials_exception
     
     user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user is None and not database.is_primary(db):
+        # A just-registered user may not have reached the replica yet
+        with database.SessionLocal() as primary_db:
+            user = primary_db.query(models.User).filter(models.User.id == user_id).first()
     if user is None:
         raise credentials_exception
     return user
 
 
+def limit_uploads(current_user: models.User = Depends(get_current_user)):
+    """Per-user upload rate limit (runs after authentication)"""
+    upload_rate_limit.hit(f"user:{current_user.id}")
+
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -156,6 +338,17 @@ class WorkoutResponse(BaseModel):
         from_attributes = True
 
 
+class UploadJobResponse(BaseModel):
+    job_id: str
+    status: str
+    error: Optional[str] = None
+    workout: Optional[WorkoutResponse] = None
+
+
+class ProfilingSettings(BaseModel):
+    sample_percent: float
+
+
 class StreakResponse(BaseModel):
     current_streak: int
     longest_streak: int
@@ -173,6 +366,25 @@ class LeaderboardEntry(BaseModel):
         from_attributes = True
 
 
+class GroupCreate(BaseModel):
+    name: str
+
+    @field_validator('name')
+    @classmethod
+    def validate_name(cls, v: str) -> str:
+        v = v.strip()
+        if not v or len(v) > 50:
+            raise ValueError('🏷️ Group names need 1 to 50 characters!')
+        return v
+
+
+class GroupResponse(BaseModel):
+    id: str
+    name: str
+    created_at: date
+    member_count: int
+
+
 class WorkoutDate(BaseModel):
     date: str
     
@@ -194,7 +406,11 @@ class WorkoutDate(BaseModel):
 
 
 # Authentication endpoints
-@app.post("/api/register", response_model=Token)
+@app.post(
+    "/api/register",
+    response_model=Token,
+    dependencies=[Depends(auth_rate_limit.by_ip), Depends(expensive_ops.slot)],
+)
 def register(user_data: UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
     # Check if username already exists
@@ -225,6 +441,7 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    database.record_write(str(new_user.id))
     
     # Create access token
     access_token = create_access_token(data={"sub": str(new_user.id)})
@@ -245,7 +462,11 @@ class LoginRequest(BaseModel):
     password: str
 
 
-@app.post("/api/login", response_model=Token)
+@app.post(
+    "/api/login",
+    response_model=Token,
+    dependencies=[Depends(auth_rate_limit.by_ip), Depends(expensive_ops.slot)],
+)
 def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     """Login and get access token"""
     user = db.query(models.User).filter(models.User.username == login_data.username).first()
@@ -270,7 +491,7 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 
 
 @app.get("/api/me", response_model=UserResponse)
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
+def get_current_user_info(current_user: models.User = Depends(get_current_user_read)):
     """Get current user information"""
     return {
         "id": str(current_user.id),
@@ -294,15 +515,13 @@ def validate_image_date(image_path: str, expected_date: date) -> tuple[bool, str
     ]
     
     try:
-        print(f"[IMAGE_VALIDATION] Starting validation for: {image_path}")
-        print(f"[IMAGE_VALIDATION] Expected date: {expected_date}")
+        logger.debug("Image validation started", extra={"image_path": image_path, "expected_date": str(expected_date)})
         
         img = Image.open(image_path)
         image_format = img.format
-        print(f"[IMAGE_VALIDATION] Image opened successfully. Format: {image_format}, Size: {img.size}")
+        logger.debug("Image opened", extra={"format": image_format, "size": img.size})
         
         exif_data = img.getexif()
-        print(f"[IMAGE_VALIDATION] EXIF data type: {type(exif_data)}, Is None: {exif_data is None}")
         
         # EXIF tag IDs: 306 = DateTime, 36867 = DateTimeOriginal
         date_time = None
@@ -310,111 +529,97 @@ def validate_image_date(image_path: str, expected_date: date) -> tuple[bool, str
         exif_datetime = None
         
         if exif_data is not None:
-            # Log all available EXIF tags
-            print(f"[IMAGE_VALIDATION] EXIF data has {len(exif_data)} tags")
-            if len(exif_data) > 0:
-                print(f"[IMAGE_VALIDATION] Available EXIF tag IDs: {list(exif_data.keys())[:10]}...")  # Show first 10
+            logger.debug("EXIF data loaded", extra={"exif_tag_count": len(exif_data)})
             
             # Try to get DateTimeOriginal (tag 36867) first, then DateTime (tag 306)
             if 36867 in exif_data:
                 date_time_original = exif_data[36867]
-                print(f"[IMAGE_VALIDATION] Found DateTimeOriginal (36867): {date_time_original}")
+                logger.debug("Found DateTimeOriginal", extra={"exif_datetime": str(date_time_original)})
             elif 306 in exif_data:
                 date_time = exif_data[306]
-                print(f"[IMAGE_VALIDATION] Found DateTime (306): {date_time}")
-            else:
-                print("[IMAGE_VALIDATION] WARNING: Neither DateTimeOriginal (36867) nor DateTime (306) found in EXIF")
-                # Try to find any date-related tags
+                logger.debug("Found DateTime", extra={"exif_datetime": str(date_time)})
+            elif logging_config.verbose_enabled():
+                # Try to find any date-related tags (only worth the scan if it will be logged)
                 date_tags = {k: v for k, v in exif_data.items() if 'date' in str(v).lower() or 'time' in str(v).lower()}
-                if date_tags:
-                    print(f"[IMAGE_VALIDATION] Found potential date tags: {date_tags}")
-                else:
-                    print("[IMAGE_VALIDATION] No date-related tags found in EXIF data")
+                logger.debug(
+                    "Neither DateTimeOriginal nor DateTime found in EXIF",
+                    extra={"exif_tag_ids": list(exif_data.keys())[:10], "date_like_tags": date_tags},
+                )
             
             # Use DateTimeOriginal if available, otherwise DateTime
             exif_datetime = date_time_original or date_time
         
         # If no EXIF datetime found, try file modification time as fallback (especially for PNG)
         if not exif_datetime:
-            print("[IMAGE_VALIDATION] No EXIF datetime found, trying file modification time as fallback...")
             try:
                 file_mtime = os.path.getmtime(image_path)
                 file_date = datetime.fromtimestamp(file_mtime).date()
-                print(f"[IMAGE_VALIDATION] File modification date: {file_date}")
+                logger.debug("No EXIF datetime, using file modification date", extra={"file_date": str(file_date)})
                 
                 # For PNG files or images without EXIF, use file modification time
                 # But only if it's today (to prevent using old files)
                 if file_date == expected_date:
-                    print("[IMAGE_VALIDATION] SUCCESS: File modification date matches expected date!")
                     return True, ""
                 else:
-                    print(f"[IMAGE_VALIDATION] File modification date ({file_date}) doesn't match expected ({expected_date})")
                     # Still allow if file was modified today (might be a fresh upload)
                     if file_date == date.today():
-                        print("[IMAGE_VALIDATION] File was modified today, allowing it")
                         return True, ""
                     else:
+                        logger.info("Image rejected: file modification date mismatch", extra={"file_date": str(file_date)})
                         import random
                         return False, random.choice(quirky_messages)
             except Exception as mtime_error:
-                print(f"[IMAGE_VALIDATION] Error getting file modification time: {mtime_error}")
+                logger.warning("Could not read file modification time: %s", mtime_error)
         
         if not exif_datetime:
-            print("[IMAGE_VALIDATION] ERROR: No datetime found in EXIF data and file modification time check failed")
-            if exif_data:
-                print(f"[IMAGE_VALIDATION] Full EXIF dump (first 20 items): {dict(list(exif_data.items())[:20])}")
+            if exif_data and logging_config.verbose_enabled():
+                logger.debug("EXIF dump (first 20 items)", extra={"exif": dict(list(exif_data.items())[:20])})
             
             # For PNG files, be more lenient - use file modification time
             if image_format == 'PNG':
-                print("[IMAGE_VALIDATION] PNG format detected - using file modification time")
                 try:
                     file_mtime = os.path.getmtime(image_path)
                     file_date = datetime.fromtimestamp(file_mtime).date()
                     if file_date == expected_date or file_date == date.today():
-                        print(f"[IMAGE_VALIDATION] PNG file modification date ({file_date}) accepted")
+                        logger.debug("PNG accepted by file modification date", extra={"file_date": str(file_date)})
                         return True, ""
                 except:
                     pass
             
+            logger.info("Image rejected: no date information")
             return False, "📸 Hmm, this photo doesn't have date info! Make sure you're taking a fresh photo with your camera (not a screenshot)."
         
-        print(f"[IMAGE_VALIDATION] Using datetime: {exif_datetime} (type: {type(exif_datetime)})")
-        
         # Parse EXIF datetime format: "YYYY:MM:DD HH:MM:SS"
         try:
             exif_date_str = str(exif_datetime).split()[0]  # Get date part
-            print(f"[IMAGE_VALIDATION] Parsed date string: {exif_date_str}")
             exif_date = datetime.strptime(exif_date_str, "%Y:%m:%d").date()
-            print(f"[IMAGE_VALIDATION] Parsed date: {exif_date}, Expected: {expected_date}")
             
             if exif_date != expected_date:
-                print(f"[IMAGE_VALIDATION] Date mismatch! Photo date: {exif_date}, Expected: {expected_date}")
+                logger.info("Image rejected: EXIF date mismatch", extra={"exif_date": str(exif_date)})
                 import random
                 return False, random.choice(quirky_messages)
             
-            print("[IMAGE_VALIDATION] SUCCESS: Date validation passed!")
+            logger.debug("Image date validation passed", extra={"exif_date": str(exif_date)})
             return True, ""
         except (ValueError, IndexError, AttributeError) as parse_error:
-            print(f"[IMAGE_VALIDATION] ERROR parsing date: {parse_error}")
-            print(f"[IMAGE_VALIDATION] Datetime value was: {exif_datetime} (type: {type(exif_datetime)})")
+            logger.info(
+                "Could not parse EXIF datetime, trying file modification time: %s", parse_error,
+                extra={"exif_datetime": str(exif_datetime)},
+            )
             
             # Fallback to file modification time if EXIF parsing fails
-            print("[IMAGE_VALIDATION] Trying file modification time as fallback...")
             try:
                 file_mtime = os.path.getmtime(image_path)
                 file_date = datetime.fromtimestamp(file_mtime).date()
                 if file_date == expected_date or file_date == date.today():
-                    print(f"[IMAGE_VALIDATION] File modification date ({file_date}) accepted as fallback")
                     return True, ""
             except:
                 pass
             
             return False, "📸 Couldn't read the photo's date! Make sure it's a fresh photo taken today."
             
-    except Exception as e:
-        print(f"[IMAGE_VALIDATION] ERROR validating image: {e}")
-        import traceback
-        print(f"[IMAGE_VALIDATION] Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error validating image date")
         return False, "📸 Something went wrong reading your photo! Try taking a fresh one."
 
 
@@ -450,7 +655,8 @@ def validate_gym_selfie(image_path: str) -> tuple[bool, str]:
                 return False, "🔍 This photo seems too small! Make sure you're uploading the full-size image."
         
         # If OpenCV is available, try face detection
-        if CV2_AVAILABLE:
+        cv2 = get_cv2()
+        if cv2 is not None:
             try:
                 # Read image with OpenCV
                 img_cv = cv2.imread(image_path)
@@ -460,18 +666,15 @@ def validate_gym_selfie(image_path: str) -> tuple[bool, str]:
                 # Convert to grayscale for face detection
                 gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
                 
-                # Load face cascade classifier
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                
-                # Detect faces
-                faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+                # Detect faces (cascade classifier is loaded once in get_cv2)
+                faces = _face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
                 
                 # If no face detected, it's probably not a selfie
                 if len(faces) == 0:
                     import random
                     return False, random.choice(quirky_messages)
             except Exception as e:
-                print(f"Face detection error (non-critical): {e}")
+                logger.warning("Face detection error (non-critical): %s", e)
                 # If face detection fails, allow it through (be lenient)
                 pass
         
@@ -479,38 +682,49 @@ def validate_gym_selfie(image_path: str) -> tuple[bool, str]:
         return True, ""
         
     except Exception as e:
-        print(f"Error validating gym selfie: {e}")
+        logger.warning("Error validating gym selfie: %s", e)
         # If validation fails completely, be lenient and allow it
         return True, ""
 
 
+def workout_rows_to_dicts(rows) -> list[dict]:
+    """Convert (date, id, image_url, notes) rows to WorkoutResponse-shaped dicts"""
+    return [
+        {"date": d.isoformat(), "id": str(i), "image_url": u, "notes": n}
+        for d, i, u, n in rows
+    ]
+
+
+def reused_photo_message(previous: models.Workout, user_id: str) -> str:
+    if previous.user_id == user_id:
+        return f"♻️ Déjà vu! You already used this photo for your {previous.date} workout. Snap a fresh gym selfie today! 📸"
+    return "♻️ We've seen this photo before! Snap a fresh gym selfie today! 📸"
+
+
 # Workout endpoints (require authentication)
 @app.get("/api/workouts", response_model=List[WorkoutResponse])
 def get_workouts(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
 ):
     """Get all workout dates for the current user"""
-    workouts = db.query(models.Workout).filter(
+    # Select plain columns so rows come back as tuples instead of ORM objects
+    rows = db.query(
+        models.Workout.date,
+        models.Workout.id,
+        models.Workout.image_url,
+        models.Workout.notes
+    ).filter(
         models.Workout.user_id == current_user.id
     ).order_by(models.Workout.date).all()
-    return [{
-        "date": str(w.date),
-        "id": str(w.id),
-        "image_url": w.image_url,
-        "notes": w.notes
-    } for w in workouts]
+    workouts = workout_rows_to_dicts(rows)
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(workouts)
+    return workouts
 
 
-@app.post("/api/workouts", response_model=WorkoutResponse)
-async def create_workout(
-    workout_date: str = Form(...),
-    notes: Optional[str] = Form(None),
-    image: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Create a workout for today (requires gym selfie image)"""
+def check_upload_request(db: Session, user_id: str, workout_date: str, image: UploadFile) -> date:
+    """Cheap checks done before an upload is stored. Returns the workout date."""
     today = date.today()
     
     # Validate date - only allow current day
@@ -531,7 +745,7 @@ async def create_workout(
     # Check if workout already exists for today
     existing = db.query(models.Workout).filter(
         and_(
-            models.Workout.user_id == current_user.id,
+            models.Workout.user_id == user_id,
             models.Workout.date == today
         )
     ).first()
@@ -539,7 +753,7 @@ async def create_workout(
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Workout already marked for today. Delete it first to create a new one."
+            detail=WORKOUT_EXISTS_MESSAGE
         )
     
     # Validate image file
@@ -549,53 +763,147 @@ async def create_workout(
             detail="File must be an image"
         )
     
-    # Save image temporarily to validate EXIF
-    file_ext = os.path.splitext(image.filename)[1] or '.jpg'
-    temp_filename = f"temp_{uuid.uuid4()}{file_ext}"
-    temp_path = os.path.join(UPLOAD_DIR, temp_filename)
-    
-    try:
-        # Save uploaded file
+    return today
+
+
+async def save_upload(image: UploadFile, temp_path: str) -> int:
+    """Write the uploaded bytes to temp_path. Returns the size in bytes."""
+    with metrics.stage("save"):
         async with aiofiles.open(temp_path, 'wb') as f:
             content = await image.read()
             await f.write(content)
-        
-        # Validate image was taken today
-        is_valid_date, date_error_msg = validate_image_date(temp_path, today)
-        if not is_valid_date:
-            os.remove(temp_path)
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=date_error_msg
+    metrics.UPLOAD_SIZE_BYTES.observe(len(content))
+    return len(content)
+
+
+def process_upload(
+    db: Session,
+    user_id: str,
+    temp_path: str,
+    workout_date: date,
+    notes: Optional[str],
+    job: Optional[models.UploadJob] = None
+) -> models.Workout:
+    """
+    Validate a stored upload and create the workout.
+    Removes the temp file and raises UploadRejected if validation fails.
+    If a job is given, it is marked succeeded in the same commit as the workout.
+    """
+    # Validate image was taken on the workout date
+    with metrics.stage("validate_image_date"):
+        is_valid_date, date_error_msg = validate_image_date(temp_path, workout_date)
+    if not is_valid_date:
+        logger.info("Upload rejected: image date", extra={"user_id": user_id})
+        os.remove(temp_path)
+        raise UploadRejected(date_error_msg)
+    
+    # Reject photos that were already used for an earlier workout. Cheap (tiny hash plus
+    # an indexed lookup), so it runs before face detection, the most expensive check
+    image_hash = None
+    if phash.PHASH_ENABLED:
+        with metrics.stage("phash"):
+            try:
+                image_hash = phash.dhash(temp_path)
+            except (OSError, ValueError) as e:
+                logger.warning("Could not compute perceptual hash: %s", e)
+    if image_hash is not None:
+        with metrics.stage("phash_lookup"):
+            previous = phash.find_similar(
+                db,
+                image_hash,
+                user_id=None if phash.PHASH_SCOPE == "global" else user_id,
             )
-        
-        # Validate it's a gym selfie
-        is_valid_selfie, selfie_error_msg = validate_gym_selfie(temp_path)
-        if not is_valid_selfie:
+        if previous is not None:
+            logger.info("Upload rejected: reused photo", extra={"user_id": user_id, "previous_workout_id": previous.id})
             os.remove(temp_path)
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=selfie_error_msg
-            )
-        
-        # Generate permanent filename
-        permanent_filename = f"{current_user.id}_{today.isoformat()}_{uuid.uuid4()}{file_ext}"
-        permanent_path = os.path.join(UPLOAD_DIR, permanent_filename)
-        
-        # Move to permanent location
+            raise UploadRejected(reused_photo_message(previous, user_id))
+    
+    # Validate it's a gym selfie
+    with metrics.stage("validate_gym_selfie"):
+        is_valid_selfie, selfie_error_msg = validate_gym_selfie(temp_path)
+    if not is_valid_selfie:
+        logger.info("Upload rejected: not a gym selfie", extra={"user_id": user_id})
+        os.remove(temp_path)
+        raise UploadRejected(selfie_error_msg)
+    
+    # Generate permanent filename
+    file_ext = os.path.splitext(temp_path)[1]
+    permanent_filename = f"{user_id}_{workout_date.isoformat()}_{uuid.uuid4()}{file_ext}"
+    permanent_path = os.path.join(UPLOAD_DIR, permanent_filename)
+    
+    # Move to permanent location
+    with metrics.stage("move"):
         shutil.move(temp_path, permanent_path)
-        image_url = f"/uploads/{permanent_filename}"
+        # A rename keeps the temp file's mtime; reset it so upload_gc's grace period
+        # starts now even if the job sat in the queue for a while
+        os.utime(permanent_path)
+    image_url = f"/uploads/{permanent_filename}"
+    
+    # Create workout
+    new_workout = models.Workout(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        date=workout_date,
+        image_url=image_url,
+        notes=notes
+    )
+    if image_hash is not None:
+        (new_workout.phash_0, new_workout.phash_1,
+         new_workout.phash_2, new_workout.phash_3) = phash.split_chunks(image_hash)
+    if job is not None:
+        job.status = jobs.SUCCEEDED
+        job.workout_id = new_workout.id
+        job.updated_at = datetime.utcnow()
+    try:
+        with metrics.stage("commit"):
+            db.add(new_workout)
+            leaderboard.refresh_user_stats(db, user_id, workout_date.replace(day=1))
+            db.commit()
+            db.refresh(new_workout)
+    except IntegrityError:
+        # Another upload for the same day won the race
+        db.rollback()
+        os.remove(permanent_path)
+        raise UploadRejected(WORKOUT_EXISTS_MESSAGE)
+    logger.info("Workout created", extra={"user_id": user_id, "workout_id": new_workout.id})
+    database.record_write(user_id)
+    return new_workout
+
+
+def process_upload_job(db: Session, job: models.UploadJob) -> models.Workout:
+    return process_upload(db, job.user_id, job.temp_path, job.workout_date, job.notes, job=job)
+
+
+upload_jobs = jobs.JobRunner(process_upload_job)
+upload_collector = upload_gc.Collector(UPLOAD_DIR)
+
+
+@app.post(
+    "/api/workouts",
+    response_model=WorkoutResponse,
+    dependencies=[Depends(limit_uploads), Depends(expensive_ops.slot)],
+)
+async def create_workout(
+    workout_date: str = Form(...),
+    notes: Optional[str] = Form(None),
+    image: UploadFile = File(...),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a workout for today (requires gym selfie image)"""
+    today = check_upload_request(db, current_user.id, workout_date, image)
+    
+    # Save image temporarily to validate EXIF
+    file_ext = os.path.splitext(image.filename)[1] or '.jpg'
+    temp_filename = f"temp_{uuid.uuid4()}{file_ext}"
+    temp_path = os.path.join(UPLOAD_DIR, temp_filename)
+    
+    try:
+        size = await save_upload(image, temp_path)
+        logger.info("Upload received", extra={"user_id": current_user.id, "upload_bytes": size})
         
-        # Create workout
-        new_workout = models.Workout(
-            user_id=current_user.id,
-            date=today,
-            image_url=image_url,
-            notes=notes
-        )
-        db.add(new_workout)
-        db.commit()
-        db.refresh(new_workout)
+        # Image decoding and face detection are CPU-bound; keep them off the event loop
+        new_workout = await run_in_threadpool(process_upload, db, current_user.id, temp_path, today, notes)
         
         return {
             "date": str(new_workout.date),
@@ -604,9 +912,13 @@ async def create_workout(
             "notes": new_workout.notes
         }
         
-    except HTTPException:
-        raise
+    except UploadRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
+        logger.exception("Error processing upload", extra={"user_id": current_user.id})
         if os.path.exists(temp_path):
             os.remove(temp_path)
         raise HTTPException(
@@ -615,6 +927,149 @@ async def create_workout(
         )
 
 
+@app.post(
+    "/api/workouts/jobs",
+    response_model=UploadJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def create_workout_job(
+    response: Response,
+    workout_date: str = Form(...),
+    notes: Optional[str] = Form(None),
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Accept a workout upload for background processing and return a job id right away.
+    Poll GET /api/workouts/jobs/{job_id} for the result. Retrying with the same
+    Idempotency-Key header returns the original job instead of processing again.
+    """
+    # Database work runs in the threadpool so accepting an upload doesn't block the event loop
+    existing, today = await run_in_threadpool(
+        check_upload_job_request, db, current_user, idempotency_key, workout_date, image
+    )
+    if existing is not None:
+        response.status_code = status.HTTP_200_OK
+        return existing
+    
+    job_id = str(uuid.uuid4())
+    file_ext = os.path.splitext(image.filename)[1] or '.jpg'
+    temp_path = os.path.join(UPLOAD_DIR, f"temp_{job_id}{file_ext}")
+    try:
+        size = await save_upload(image, temp_path)
+    except Exception:
+        logger.exception("Error storing upload", extra={"user_id": current_user.id})
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error storing image"
+        )
+    
+    job = models.UploadJob(
+        id=job_id,
+        user_id=current_user.id,
+        idempotency_key=idempotency_key,
+        status=jobs.PENDING,
+        workout_date=today,
+        temp_path=temp_path,
+        notes=notes,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+    result, created = await run_in_threadpool(save_upload_job, db, job)
+    if not created:
+        response.status_code = status.HTTP_200_OK
+        return result
+    
+    logger.info("Upload job accepted", extra={"user_id": current_user.id, "job_id": job_id, "upload_bytes": size})
+    upload_jobs.submit(job_id)
+    return result
+
+
+def check_upload_job_request(
+    db: Session,
+    user: models.User,
+    idempotency_key: Optional[str],
+    workout_date: str,
+    image: UploadFile
+) -> tuple[Optional[dict], Optional[date]]:
+    """(response for an existing job with this Idempotency-Key, None) or (None, workout date)"""
+    if idempotency_key:
+        existing_job = find_upload_job(db, user.id, idempotency_key)
+        if existing_job is not None:
+            return upload_job_response(db, existing_job), None
+    
+    # Only new uploads count against the rate limit; retries above are free
+    limit_uploads(user)
+    
+    return None, check_upload_request(db, user.id, workout_date, image)
+
+
+def save_upload_job(db: Session, job: models.UploadJob) -> tuple[dict, bool]:
+    """Commit a new job. Returns (job response, created); created is False if a concurrent
+    retry with the same Idempotency-Key got there first (its job is returned instead)."""
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        os.remove(job.temp_path)
+        return upload_job_response(db, find_upload_job(db, job.user_id, job.idempotency_key)), False
+    return upload_job_response(db, job), True
+
+
+@app.get("/api/workouts/jobs/{job_id}", response_model=UploadJobResponse)
+def get_workout_job(
+    job_id: str,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the status of an upload job (and the workout once it has succeeded)"""
+    job = db.query(models.UploadJob).filter(
+        and_(
+            models.UploadJob.id == job_id,
+            models.UploadJob.user_id == current_user.id
+        )
+    ).first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload job not found"
+        )
+    return upload_job_response(db, job)
+
+
+def find_upload_job(db: Session, user_id: str, idempotency_key: str) -> Optional[models.UploadJob]:
+    return db.query(models.UploadJob).filter(
+        and_(
+            models.UploadJob.user_id == user_id,
+            models.UploadJob.idempotency_key == idempotency_key
+        )
+    ).first()
+
+
+def upload_job_response(db: Session, job: models.UploadJob) -> dict:
+    workout = None
+    if job.workout_id:
+        w = db.get(models.Workout, job.workout_id)
+        if w is not None:
+            workout = {
+                "date": str(w.date),
+                "id": str(w.id),
+                "image_url": w.image_url,
+                "notes": w.notes
+            }
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "workout": workout
+    }
+
+
 @app.delete("/api/workouts/{workout_date}")
 def delete_workout(
     workout_date: str,
@@ -652,17 +1107,22 @@ def delete_workout(
             detail="Workout not found"
         )
     
-    # Delete image file
-    if existing.image_url:
-        image_path = existing.image_url.replace('/uploads/', UPLOAD_DIR + '/')
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except:
-                pass  # Continue even if file deletion fails
-    
+    image_url = existing.image_url
     db.delete(existing)
+    leaderboard.refresh_user_stats(db, current_user.id, today.replace(day=1))
     db.commit()
+    database.record_write(current_user.id)
+    
+    # Delete image file once the workout is gone; if this fails the file is
+    # unreferenced and upload_gc removes it later
+    if image_url:
+        image_path = image_url.replace('/uploads/', UPLOAD_DIR + '/')
+        try:
+            os.remove(image_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not delete workout image %s: %s", image_path, e)
     
     return {"message": "Workout deleted successfully"}
 
@@ -732,8 +1192,8 @@ def calculate_streaks(workout_dates: List[date], today: date) -> tuple[int, int]
 
 @app.get("/api/streaks", response_model=StreakResponse)
 def get_streaks(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
 ):
     """Get current streak and longest streak for the current user"""
     workouts = db.query(models.Workout).filter(
@@ -750,81 +1210,246 @@ def get_streaks(
     }
 
 
+def parse_leaderboard_month(month: Optional[str], today: date) -> date:
+    """First day of the requested month (default: current month)"""
+    if month is None:
+        return date(today.year, today.month, 1)
+    try:
+        month_start = leaderboard.parse_month(month)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid month format. Use YYYY-MM"
+        )
+    if month_start > today:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="🔮 No peeking into the future! That month hasn't started yet."
+        )
+    return month_start
+
+
 @app.get("/api/leaderboard", response_model=List[LeaderboardEntry])
 def get_leaderboard(
+    month: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Monthly leaderboard ranking all users by workouts in the month, current streak, and longest streak.
+    Defaults to the current month; past months (?month=YYYY-MM) are served from snapshots.
+    """
+    today = date.today()
+    month_start = parse_leaderboard_month(month, today)
+    ranked_data = leaderboard.month_leaderboard(db, month_start, today)
+    
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(ranked_data)
+    return ranked_data
+
+
+@app.post("/api/groups", response_model=GroupResponse)
+def create_group(
+    group_data: GroupCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get monthly leaderboard ranking all users by workouts in current month, current streak, and longest streak"""
-    # Get all users
-    all_users = db.query(models.User).all()
-    
+    """Create a group; the creator joins it"""
     today = date.today()
-    # Get first day of current month
-    first_day_of_month = date(today.year, today.month, 1)
-    # Get first day of next month for filtering
-    if today.month == 12:
-        first_day_of_next_month = date(today.year + 1, 1, 1)
-    else:
-        first_day_of_next_month = date(today.year, today.month + 1, 1)
-    
-    leaderboard_data = []
-    
-    for user in all_users:
-        # Get all workouts for this user (for streaks calculation)
-        all_workouts = db.query(models.Workout).filter(
-            models.Workout.user_id == user.id
-        ).all()
-        
-        # Get workouts for current month only
-        monthly_workouts = db.query(models.Workout).filter(
-            and_(
-                models.Workout.user_id == user.id,
-                models.Workout.date >= first_day_of_month,
-                models.Workout.date < first_day_of_next_month
-            )
-        ).all()
-        
-        all_workout_dates = [w.date for w in all_workouts]
-        monthly_workout_dates = [w.date for w in monthly_workouts]
-        
-        # Monthly total workouts
-        total_workouts = len(monthly_workout_dates)
-        
-        # Calculate streaks (using all workouts, not just monthly)
-        current_streak, longest_streak = calculate_streaks(all_workout_dates, today)
-        
-        leaderboard_data.append({
-            "user_id": str(user.id),
-            "username": user.username,
-            "total_workouts": total_workouts,
-            "current_streak": current_streak,
-            "longest_streak": longest_streak
-        })
-    
-    # Sort by: 1) total_workouts (monthly, desc), 2) current_streak (desc), 3) longest_streak (desc)
-    leaderboard_data.sort(
-        key=lambda x: (x["total_workouts"], x["current_streak"], x["longest_streak"]),
-        reverse=True
+    group = models.Group(
+        id=str(uuid.uuid4()),
+        name=group_data.name,
+        created_by=current_user.id,
+        created_at=today
     )
+    db.add(group)
+    db.add(models.GroupMember(group_id=group.id, user_id=current_user.id, joined_at=today))
+    db.commit()
+    database.record_write(current_user.id)
+    return group_response(group, member_count=1)
+
+
+@app.get("/api/groups", response_model=List[GroupResponse])
+def get_groups(
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """Groups the current user belongs to"""
+    member_counts = db.query(
+        models.GroupMember.group_id,
+        func.count(models.GroupMember.user_id)
+    ).group_by(models.GroupMember.group_id).subquery()
+    rows = db.query(models.Group, member_counts.c[1]).join(
+        models.GroupMember,
+        and_(models.GroupMember.group_id == models.Group.id, models.GroupMember.user_id == current_user.id)
+    ).join(
+        member_counts, member_counts.c.group_id == models.Group.id
+    ).order_by(models.Group.name).all()
+    return [group_response(group, member_count) for group, member_count in rows]
+
+
+@app.post("/api/groups/{group_id}/members", response_model=GroupResponse)
+def join_group(
+    group_id: str,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Join a group (share the group id with friends to invite them)"""
+    group = get_group_or_404(db, group_id)
+    if db.get(models.GroupMember, (group_id, current_user.id)) is None:
+        db.add(models.GroupMember(group_id=group_id, user_id=current_user.id, joined_at=date.today()))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # Joined twice at once
+        database.record_write(current_user.id)
+    member_count = db.query(func.count(models.GroupMember.user_id)).filter(
+        models.GroupMember.group_id == group_id
+    ).scalar()
+    return group_response(group, member_count)
+
+
+@app.get("/api/groups/{group_id}/leaderboard", response_model=List[LeaderboardEntry])
+def get_group_leaderboard(
+    group_id: str,
+    month: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """Leaderboard of a group's members (members only), same ranking as /api/leaderboard"""
+    get_group_or_404(db, group_id)
+    if db.get(models.GroupMember, (group_id, current_user.id)) is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="🚪 Members only! Join this group to see its leaderboard."
+        )
+    today = date.today()
+    month_start = parse_leaderboard_month(month, today)
+    ranked_data = leaderboard.month_leaderboard(db, month_start, today, group_id=group_id)
     
-    # Add rank (handle ties by giving same rank)
-    ranked_data = []
-    current_rank = 1
-    prev_stats = None
-    
-    for entry in leaderboard_data:
-        stats = (entry["total_workouts"], entry["current_streak"], entry["longest_streak"])
-        if prev_stats and stats != prev_stats:
-            current_rank = len(ranked_data) + 1
-        entry["rank"] = current_rank
-        ranked_data.append(entry)
-        prev_stats = stats
-    
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(ranked_data)
     return ranked_data
 
 
+def get_group_or_404(db: Session, group_id: str) -> models.Group:
+    group = db.get(models.Group, group_id)
+    if group is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+    return group
+
+
+def group_response(group: models.Group, member_count: int) -> dict:
+    return {
+        "id": group.id,
+        "name": group.name,
+        "created_at": group.created_at,
+        "member_count": member_count
+    }
+
+
 @app.get("/api/health")
 def health_check():
     """Health check endpoint"""
     return {"status": "ok"}
+
+
+@app.get("/api/ready")
+def readiness_check(db: Session = Depends(get_db)):
+    """Deep readiness check: measures database and upload directory latency"""
+    checks = {}
+    healthy = True
+
+    started = time.perf_counter()
+    try:
+        db.execute(text("SELECT 1"))
+        checks["database"] = {"ok": True}
+    except Exception as e:
+        logger.warning("Readiness check: database unavailable: %s", e)
+        checks["database"] = {"ok": False, "error": str(e)}
+        healthy = False
+    checks["database"]["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    started = time.perf_counter()
+    probe_path = os.path.join(UPLOAD_DIR, f".ready_{uuid.uuid4()}")
+    try:
+        with open(probe_path, "wb") as f:
+            f.write(b"ok")
+        os.remove(probe_path)
+        checks["upload_dir"] = {"ok": True}
+    except OSError as e:
+        logger.warning("Readiness check: upload directory not writable: %s", e)
+        checks["upload_dir"] = {"ok": False, "error": str(e)}
+        healthy = False
+    checks["upload_dir"]["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    for name, result in checks.items():
+        metrics.READINESS_CHECK_DURATION.set(result["latency_ms"] / 1000, check=name)
+
+    return JSONResponse(
+        {"status": "ok" if healthy else "unavailable", "checks": checks},
+        status_code=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    """Prometheus metrics for this worker. Set METRICS_TOKEN to require a bearer token."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_profiling_token(authorization: Optional[str] = Header(None)):
+    """Admin access to /debug: `Authorization: Bearer <PROFILING_TOKEN>`. 404 when profiling is off."""
+    if not profiling.enabled():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    token = authorization[len("Bearer "):] if authorization and authorization.startswith("Bearer ") else None
+    if not profiling.check_token(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid profiling token")
+
+
+@app.get("/debug/profiles", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def list_profiles():
+    """Profiles stored in this worker, newest first"""
+    return {"sample_percent": profiling.sample_percent, "profiles": profiling.list_profiles()}
+
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def get_profile(profile_id: str):
+    """Collapsed stacks, for flamegraph.pl or speedscope"""
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
+
+
+@app.post("/debug/profiling", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def set_profiling(settings: ProfilingSettings):
+    """Profile a percentage of all requests on this worker (0 turns it off)"""
+    profiling.set_sample_percent(settings.sample_percent)
+    return {"sample_percent": profiling.sample_percent}
+
+
+@app.post("/debug/tracemalloc/start", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def start_tracemalloc(frames: int = 10):
+    profiling.tracemalloc_start(max(1, min(frames, 50)))
+    return {"tracing": True}
+
+
+@app.post("/debug/tracemalloc/snapshot", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def tracemalloc_snapshot(limit: int = 25):
+    """Top allocation sites, and growth since the first snapshot after start"""
+    try:
+        return PlainTextResponse(profiling.tracemalloc_report(limit=max(1, min(limit, 200))))
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@app.post("/debug/tracemalloc/stop", include_in_schema=False, dependencies=[Depends(require_profiling_token)])
+def stop_tracemalloc():
+    profiling.tracemalloc_stop()
+    return {"tracing": False}
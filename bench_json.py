@@ -0,0 +1,104 @@
+"""
+Benchmark the list-endpoint serialization paths.
+
+Compares, for N synthetic rows (default 10,000):
+- default: FastAPI's response_model path (validate each dict as WorkoutResponse /
+  LeaderboardEntry, jsonable_encoder, stdlib json encoder)
+- fast: what get_workouts/get_leaderboard do with FAST_JSON_RESPONSES=true
+  (dicts built straight from row tuples, rendered by ORJSONResponse)
+
+Only CPU time (time.process_time) is reported; no database or HTTP is involved.
+
+Usage:
+    python bench_json.py [rows] [repeats]
+"""
+import asyncio
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import app
+
+
+def make_workout_rows(n: int) -> list[tuple]:
+    start = date(2000, 1, 1)
+    return [
+        (start + timedelta(days=i), str(uuid.uuid4()), f"/uploads/{uuid.uuid4()}.jpg", "leg day" if i % 3 else None)
+        for i in range(n)
+    ]
+
+
+def make_leaderboard_rows(n: int) -> list[dict]:
+    return [
+        {
+            "user_id": str(uuid.uuid4()),
+            "username": f"user{i}",
+            "total_workouts": n - i,
+            "current_streak": i % 30,
+            "longest_streak": i % 90,
+            "rank": i + 1,
+        }
+        for i in range(n)
+    ]
+
+
+def default_path(field, content) -> bytes:
+    """What FastAPI does with a list returned from a handler with response_model set"""
+    encoded = asyncio.run(serialize_response(field=field, response_content=content))
+    return JSONResponse(encoded).body
+
+
+def cpu_seconds(fn, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.process_time()
+        fn()
+        best = min(best, time.process_time() - started)
+    return best
+
+
+def report(name: str, default_fn, fast_fn, repeats: int):
+    assert len(default_fn()) > 0 and len(fast_fn()) > 0
+    default_s = cpu_seconds(default_fn, repeats)
+    fast_s = cpu_seconds(fast_fn, repeats)
+    saved = (1 - fast_s / default_s) * 100 if default_s else 0.0
+    print(
+        f"{name:<12} default {default_s * 1000:8.1f} ms   fast {fast_s * 1000:8.1f} ms   "
+        f"CPU saved {saved:5.1f}%  ({default_s / fast_s if fast_s else float('inf'):.1f}x)"
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Response class: {app.FastJSONResponse.__name__}, rows: {rows}, best of {repeats}")
+
+    workout_rows = make_workout_rows(rows)
+    workout_field = create_response_field(name="bench_workouts", type_=List[app.WorkoutResponse])
+    report(
+        "workouts",
+        # The handler built these dicts before this change too, so both paths pay for it
+        lambda: default_path(workout_field, app.workout_rows_to_dicts(workout_rows)),
+        lambda: app.FastJSONResponse(app.workout_rows_to_dicts(workout_rows)).body,
+        repeats,
+    )
+
+    leaderboard = make_leaderboard_rows(rows)
+    leaderboard_field = create_response_field(name="bench_leaderboard", type_=List[app.LeaderboardEntry])
+    report(
+        "leaderboard",
+        lambda: default_path(leaderboard_field, leaderboard),
+        lambda: app.FastJSONResponse(leaderboard).body,
+        repeats,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,184 @@
+import itertools
+import logging
 import os
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Try to import redis for sharing read-your-writes state between processes, but make it optional
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger("workout.database")
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not DATABASE_URL:
     # Fallback for local development with SQLite
     DATABASE_URL = "sqlite:///./workout_calendar.db"
-    connect_args = {"check_same_thread": False}
-else:
-    # PostgreSQL connection args
-    connect_args = {"sslmode": "require"}
-
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    connect_args=connect_args,
-)
+
+# Optional read replicas, comma separated. Read-only endpoints are spread across them
+# round-robin; writes and anything else always use DATABASE_URL.
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+# How long a replica that failed a health check is skipped before being tried again
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# After a user writes, their reads go to the primary for this long so they see their
+# own changes even if the replicas lag behind
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Where that window is tracked. "memory" only covers the worker process that handled the
+# write; with several workers/instances, or UPLOAD_JOB_MODE=external (the write happens
+# in `python jobs.py worker`), use "redis" so every process sees it. Defaults to the
+# rate limiter's backend, so one RATE_LIMIT_BACKEND=redis setting covers both.
+READ_YOUR_WRITES_BACKEND = os.getenv("READ_YOUR_WRITES_BACKEND", os.getenv("RATE_LIMIT_BACKEND", "memory"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def connect_args_for(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {"check_same_thread": False}
+    # PostgreSQL connection args (set DATABASE_SSLMODE=disable for local instances)
+    return {"sslmode": os.getenv("DATABASE_SSLMODE", "require")}
+
+
+def make_engine(url: str):
+    return create_engine(
+        url,
+        pool_pre_ping=True,
+        connect_args=connect_args_for(url),
+    )
+
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_engines = [make_engine(url) for url in DATABASE_REPLICA_URLS]
+ReplicaSession = sessionmaker(autocommit=False, autoflush=False)
+
 Base = declarative_base()
+
+
+class ReplicaRouter:
+    """Round-robin over replicas, skipping ones that recently failed a health check"""
+
+    def __init__(self, engines: list):
+        self.engines = engines
+        self._cycle = itertools.cycle(range(len(engines))) if engines else None
+        self._down_until: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def candidates(self) -> list:
+        """Healthy replicas in round-robin order, starting with the next one in turn"""
+        if not self.engines:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            start = next(self._cycle)
+            order = [(start + i) % len(self.engines) for i in range(len(self.engines))]
+            return [(i, self.engines[i]) for i in order if self._down_until.get(i, 0) <= now]
+
+    def mark_down(self, index: int):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+replica_router = ReplicaRouter(replica_engines)
+
+class InMemoryWriteTracker:
+    """Recent writers in this process only"""
+
+    def __init__(self):
+        self._until: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id: str):
+        if not replica_engines:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + READ_YOUR_WRITES_SECONDS
+            # Drop expired entries so the dict doesn't grow with every user who ever wrote
+            if len(self._until) > 10000:
+                for key in [k for k, until in self._until.items() if until <= now]:
+                    del self._until[key]
+
+    def wrote_recently(self, user_id: str) -> bool:
+        with self._lock:
+            until = self._until.get(user_id)
+        return until is not None and until > time.monotonic()
+
+
+class RedisWriteTracker:
+    """Recent writers as expiring Redis keys, shared by all workers and the job worker"""
+
+    def __init__(self, url: str):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("READ_YOUR_WRITES_BACKEND=redis requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def record(self, user_id: str):
+        # Recorded even by processes without replicas configured (the job worker),
+        # since the API processes reading it may have them
+        try:
+            self._client.set(f"ryw:{user_id}", 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+        except redis.RedisError as e:
+            logger.warning("Could not record write for read-your-writes: %s", e)
+
+    def wrote_recently(self, user_id: str) -> bool:
+        try:
+            return bool(self._client.exists(f"ryw:{user_id}"))
+        except redis.RedisError as e:
+            # Can't tell, so be safe and read from the primary
+            logger.warning("Read-your-writes backend unavailable, reading from primary: %s", e)
+            return True
+
+
+def create_write_tracker():
+    if READ_YOUR_WRITES_BACKEND == "redis":
+        return RedisWriteTracker(REDIS_URL)
+    return InMemoryWriteTracker()
+
+
+write_tracker = create_write_tracker()
+
+
+def record_write(user_id: str):
+    """Pin this user's reads to the primary for READ_YOUR_WRITES_SECONDS"""
+    write_tracker.record(user_id)
+
+
+def wrote_recently(user_id: str) -> bool:
+    return write_tracker.wrote_recently(user_id)
+
+
+def read_session(user_id: str = None):
+    """
+    Session for read-only work: a healthy replica if any are configured, otherwise
+    (or if the user wrote recently, or every replica is down) the primary.
+    """
+    if not replica_engines or (user_id and wrote_recently(user_id)):
+        return SessionLocal()
+
+    for index, replica in replica_router.candidates():
+        session = ReplicaSession(bind=replica)
+        try:
+            # Check out a connection now (pool_pre_ping validates it) so a dead
+            # replica is detected here rather than in the middle of the handler
+            session.connection()
+            return session
+        except OperationalError:
+            session.close()
+            replica_router.mark_down(index)
+    return SessionLocal()
+
+
+def is_primary(session) -> bool:
+    return session.get_bind() is engine
@@ -0,0 +1,196 @@
+"""
+Accept-then-process uploads.
+
+POST /api/workouts/jobs stores the image, records an upload_jobs row and returns a job
+id immediately; validation (EXIF date, face detection, perceptual hash) and creating the
+workout happen afterwards. Clients poll GET /api/workouts/jobs/{job_id}.
+
+The upload_jobs table is the queue. Two ways to run it:
+- UPLOAD_JOB_MODE=inprocess (default): each API worker processes jobs in a small thread
+  pool (UPLOAD_JOB_WORKERS threads)
+- UPLOAD_JOB_MODE=external: the API only enqueues; run `python jobs.py worker` as a
+  separate process on the same machine/volume (it needs the temp files in UPLOAD_DIR)
+
+A job is claimed with a conditional UPDATE (pending -> processing), so several workers
+can poll the same table without processing a job twice. Jobs stuck in processing for
+longer than UPLOAD_JOB_TIMEOUT seconds (worker crashed) are put back to pending. In
+in-process mode a background thread sweeps for those, and for pending jobs whose worker
+died before running them, every UPLOAD_JOB_SWEEP_INTERVAL seconds (the first sweep runs
+right after startup, off the startup path, so a database hiccup doesn't stop the worker
+from serving).
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import database
+import logging_config
+import metrics
+import models
+
+logger = logging_config.get_logger("jobs")
+
+UPLOAD_JOB_MODE = os.getenv("UPLOAD_JOB_MODE", "inprocess")
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+UPLOAD_JOB_TIMEOUT = float(os.getenv("UPLOAD_JOB_TIMEOUT", "300"))
+UPLOAD_JOB_POLL_INTERVAL = float(os.getenv("UPLOAD_JOB_POLL_INTERVAL", "1.0"))
+# How often in-process runners sweep for stuck/orphaned jobs (external workers poll every UPLOAD_JOB_POLL_INTERVAL)
+UPLOAD_JOB_SWEEP_INTERVAL = float(os.getenv("UPLOAD_JOB_SWEEP_INTERVAL", str(UPLOAD_JOB_POLL_INTERVAL * 30)))
+
+PENDING = "pending"
+PROCESSING = "processing"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+UPLOAD_JOBS = metrics.Counter("upload_jobs_total", "Upload jobs finished, by outcome", labels=("status",))
+
+
+class UploadRejected(Exception):
+    """An upload failed validation. The message is shown to the user."""
+
+
+class JobRunner:
+    """
+    Runs upload jobs with `process(db, job) -> models.Workout`, which raises
+    UploadRejected when the image doesn't pass validation.
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self._executor = None
+        self._sweeper = None
+        self._stop = threading.Event()
+        # Jobs submitted to this runner and not finished yet, so sweeps don't queue them twice
+        self._queued: set[str] = set()
+        self._queued_lock = threading.Lock()
+
+    def start(self):
+        """Start the in-process pool and the sweeper that picks up stuck or leftover jobs"""
+        if UPLOAD_JOB_MODE != "inprocess" or self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job")
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_forever, name="upload-job-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def submit(self, job_id: str, context: contextvars.Context = None):
+        """Queue a job for processing (no-op in external mode; the worker polls for it)"""
+        if self._executor is None:
+            return
+        with self._queued_lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        # Carry the request id over so the job's log lines match the upload request
+        context = context or contextvars.copy_context()
+        self._executor.submit(context.run, self._run_queued, job_id)
+
+    def _run_queued(self, job_id: str):
+        try:
+            self.run(job_id)
+        finally:
+            with self._queued_lock:
+                self._queued.discard(job_id)
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                for job_id in self.recover():
+                    self.submit(job_id, contextvars.Context())
+            except Exception:
+                logger.exception("Upload job sweep failed")
+            if self._stop.wait(UPLOAD_JOB_SWEEP_INTERVAL):
+                return
+
+    def recover(self) -> list[str]:
+        """Reset jobs stuck in processing and return ids of pending jobs, oldest first"""
+        db = database.SessionLocal()
+        try:
+            stuck_before = datetime.utcnow() - timedelta(seconds=UPLOAD_JOB_TIMEOUT)
+            reset = db.query(models.UploadJob).filter(
+                models.UploadJob.status == PROCESSING,
+                models.UploadJob.updated_at < stuck_before,
+            ).update({"status": PENDING, "updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            if reset:
+                logger.warning("Requeued %s stuck upload jobs", reset)
+            rows = db.query(models.UploadJob.id).filter(
+                models.UploadJob.status == PENDING
+            ).order_by(models.UploadJob.created_at).limit(1000).all()
+            return [row.id for row in rows]
+        finally:
+            db.close()
+
+    def claim(self, db, job_id: str) -> bool:
+        claimed = db.query(models.UploadJob).filter(
+            models.UploadJob.id == job_id,
+            models.UploadJob.status == PENDING,
+        ).update({"status": PROCESSING, "updated_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    def run(self, job_id: str):
+        db = database.SessionLocal()
+        try:
+            if not self.claim(db, job_id):
+                return
+            job = db.get(models.UploadJob, job_id)
+            started = time.perf_counter()
+            try:
+                workout = self.process(db, job)
+                job.status = SUCCEEDED
+                job.workout_id = workout.id
+            except UploadRejected as e:
+                db.rollback()
+                job.status = FAILED
+                job.error = str(e)
+            except Exception:
+                logger.exception("Upload job failed", extra={"job_id": job_id})
+                db.rollback()
+                job.status = FAILED
+                job.error = "📸 Something went wrong processing your photo! Try uploading it again."
+                if job.temp_path and os.path.exists(job.temp_path):
+                    os.remove(job.temp_path)
+            job.updated_at = datetime.utcnow()
+            db.commit()
+            UPLOAD_JOBS.inc(status=job.status)
+            logger.info(
+                "Upload job finished",
+                extra={"job_id": job_id, "status": job.status, "seconds": round(time.perf_counter() - started, 3)},
+            )
+        finally:
+            db.close()
+
+    def poll_forever(self):
+        """Worker loop for UPLOAD_JOB_MODE=external"""
+        logger.info("Upload job worker started", extra={"threads": UPLOAD_JOB_WORKERS})
+        with ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job") as executor:
+            while True:
+                job_ids = self.recover()
+                if job_ids:
+                    # Wait for the batch so we don't re-read jobs we are still working on
+                    list(executor.map(self.run, job_ids))
+                else:
+                    time.sleep(UPLOAD_JOB_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        import app
+        app.upload_jobs.poll_forever()
+    else:
+        print("Usage: python jobs.py worker")
+        sys.exit(1)
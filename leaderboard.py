@@ -0,0 +1,383 @@
+"""
+Leaderboards computed from per-user aggregates instead of scanning every workout.
+
+- user_monthly_stats: workouts per user per month ("YYYY-MM")
+- user_streaks: per user, the date of their latest workout, the length of the run of
+  consecutive days ending on it, and their longest streak ever
+
+Both are recomputed for the affected user inside the same transaction whenever a
+workout is created or deleted (refresh_user_stats), so they can't drift.
+
+The current month is ranked live from the aggregates in one query (optionally joined
+to group_members for a group board). Finished months are archived in
+leaderboard_snapshots (plus a leaderboard_months row marking the month as done) when
+the month closes, and served from there:
+
+    python leaderboard.py snapshot            # snapshot last month (run from cron on the 1st)
+    python leaderboard.py snapshot 2025-01    # snapshot a specific month
+
+Aggregates can be recomputed from the workouts table at any time (idempotent, commits
+per batch of users). Run it once after deploying the code that maintains them, since
+workouts written by the previous release after the migration's backfill aren't counted:
+
+    python leaderboard.py rebuild                   # every month
+    python leaderboard.py rebuild --since 2025-01   # monthly totals from 2025-01 on (streaks always in full)
+
+A past month that hasn't been snapshotted yet is snapshotted on first request (once,
+see ensure_snapshot). Months before the first user signed up are returned empty without
+writing anything.
+"""
+import itertools
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import database
+import logging_config
+import models
+
+logger = logging_config.get_logger("leaderboard")
+
+# Base of the PostgreSQL advisory lock keys for snapshot writes (plus YYYYMM)
+SNAPSHOT_LOCK_KEY = 0x4C420000 * 1000000
+
+
+def month_key(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def parse_month(value: str) -> date:
+    """'YYYY-MM' -> first day of that month. Raises ValueError if malformed."""
+    year, month = value.split("-")
+    if len(year) != 4 or len(month) != 2:
+        raise ValueError(value)
+    return date(int(year), int(month), 1)
+
+
+def month_bounds(first_day: date) -> tuple[date, date]:
+    """(first day, first day of next month)"""
+    if first_day.month == 12:
+        return first_day, date(first_day.year + 1, 1, 1)
+    return first_day, date(first_day.year, first_day.month + 1, 1)
+
+
+def streak_state(workout_dates) -> tuple:
+    """(last workout date, run length ending on it, longest run) from dates in any order"""
+    last_date = None
+    run = longest = 0
+    for d in sorted(set(workout_dates)):
+        if last_date is not None and d == last_date + timedelta(days=1):
+            run += 1
+        else:
+            run = 1
+        longest = max(longest, run)
+        last_date = d
+    return last_date, run, longest
+
+
+def current_streak(last_date: date, run_length: int, today: date) -> int:
+    """A run counts as current if it ends today or yesterday (same rule as calculate_streaks)"""
+    if last_date is None or last_date < today - timedelta(days=1):
+        return 0
+    return run_length
+
+
+def refresh_user_stats(db: Session, user_id: str, month_start: date):
+    """Recompute a user's aggregates after one of their workouts in `month_start`'s month changed.
+    Call before commit; the caller's pending changes are flushed first."""
+    db.flush()
+    start, end = month_bounds(month_start)
+    month = month_key(start)
+
+    total = db.query(func.count(models.Workout.id)).filter(
+        models.Workout.user_id == user_id,
+        models.Workout.date >= start,
+        models.Workout.date < end,
+    ).scalar()
+    _set_month_total(db, user_id, month, total)
+
+    dates = [row[0] for row in db.query(models.Workout.date).filter(models.Workout.user_id == user_id)]
+    _set_streaks(db, user_id, dates)
+
+
+def rebuild_user_stats(db: Session, user_id: str, since: date = None):
+    """Recompute all of a user's aggregates from their workouts (monthly totals from `since` on)"""
+    dates = [row[0] for row in db.query(models.Workout.date).filter(models.Workout.user_id == user_id)]
+    totals: dict[str, int] = {}
+    for d in dates:
+        if since is None or d >= since:
+            totals[month_key(d)] = totals.get(month_key(d), 0) + 1
+    # Months that have a row but no workouts any more go back to zero
+    stale = db.query(models.UserMonthlyStats.month).filter(models.UserMonthlyStats.user_id == user_id)
+    if since is not None:
+        stale = stale.filter(models.UserMonthlyStats.month >= month_key(since))
+    for (month,) in stale:
+        totals.setdefault(month, 0)
+    for month, total in totals.items():
+        _set_month_total(db, user_id, month, total)
+    _set_streaks(db, user_id, dates)
+
+
+def rebuild(since: date = None, batch_size: int = 200):
+    """Recompute aggregates for every user, committing per batch. Safe to re-run."""
+    db = database.SessionLocal()
+    done = 0
+    last_id = ""
+    started = time.perf_counter()
+    try:
+        while True:
+            user_ids = [row[0] for row in db.query(models.User.id).filter(
+                models.User.id > last_id
+            ).order_by(models.User.id).limit(batch_size)]
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                rebuild_user_stats(db, user_id, since)
+            db.commit()
+            last_id = user_ids[-1]
+            done += len(user_ids)
+            print(f"Rebuilt {done} users ({done / (time.perf_counter() - started):.0f} users/s)")
+    finally:
+        db.close()
+
+
+def _set_month_total(db: Session, user_id: str, month: str, total: int):
+    stats = db.get(models.UserMonthlyStats, (user_id, month))
+    if stats is None:
+        db.add(models.UserMonthlyStats(user_id=user_id, month=month, total_workouts=total))
+    else:
+        stats.total_workouts = total
+
+
+def _set_streaks(db: Session, user_id: str, dates: list):
+    last_date, run_length, longest = streak_state(dates)
+    streaks = db.get(models.UserStreak, user_id)
+    if streaks is None:
+        streaks = models.UserStreak(user_id=user_id)
+        db.add(streaks)
+    streaks.last_workout_date = last_date
+    streaks.run_length = run_length
+    streaks.longest_streak = longest
+
+
+def rank_entries(entries: list[dict]) -> list[dict]:
+    """Sort by monthly workouts, current streak, longest streak (all desc); ties share a rank"""
+    entries.sort(
+        key=lambda x: (x["total_workouts"], x["current_streak"], x["longest_streak"]),
+        reverse=True
+    )
+    ranked = []
+    current_rank = 1
+    prev_stats = None
+    for entry in entries:
+        stats = (entry["total_workouts"], entry["current_streak"], entry["longest_streak"])
+        if prev_stats and stats != prev_stats:
+            current_rank = len(ranked) + 1
+        entry["rank"] = current_rank
+        ranked.append(entry)
+        prev_stats = stats
+    return ranked
+
+
+def live_leaderboard(db: Session, month_start: date, today: date, group_id: str = None) -> list[dict]:
+    """Rank users (or a group's members) for a month from the aggregates, in one query"""
+    month = month_key(month_start)
+    query = db.query(
+        models.User.id,
+        models.User.username,
+        models.UserMonthlyStats.total_workouts,
+        models.UserStreak.last_workout_date,
+        models.UserStreak.run_length,
+        models.UserStreak.longest_streak,
+    )
+    if group_id is not None:
+        query = query.join(
+            models.GroupMember,
+            and_(models.GroupMember.user_id == models.User.id, models.GroupMember.group_id == group_id),
+        )
+    rows = query.outerjoin(
+        models.UserMonthlyStats,
+        and_(models.UserMonthlyStats.user_id == models.User.id, models.UserMonthlyStats.month == month),
+    ).outerjoin(
+        models.UserStreak, models.UserStreak.user_id == models.User.id
+    ).all()
+
+    return rank_entries([
+        {
+            "user_id": str(user_id),
+            "username": username,
+            "total_workouts": total or 0,
+            "current_streak": current_streak(last_date, run_length or 0, today),
+            "longest_streak": longest or 0,
+        }
+        for user_id, username, total, last_date, run_length, longest in rows
+    ])
+
+
+def snapshot_leaderboard(db: Session, month_start: date, group_id: str = None) -> list[dict] | None:
+    """Archived board for a finished month (re-ranked within the group if given), or None if not snapshotted"""
+    month = month_key(month_start)
+    if db.get(models.LeaderboardMonth, month) is None:
+        return None
+    query = db.query(models.LeaderboardSnapshot).filter(models.LeaderboardSnapshot.month == month)
+    if group_id is not None:
+        query = query.join(
+            models.GroupMember,
+            and_(
+                models.GroupMember.user_id == models.LeaderboardSnapshot.user_id,
+                models.GroupMember.group_id == group_id,
+            ),
+        )
+    entries = [
+        {
+            "user_id": s.user_id,
+            "username": s.username,
+            "total_workouts": s.total_workouts,
+            "current_streak": s.current_streak,
+            "longest_streak": s.longest_streak,
+            "rank": s.rank,
+        }
+        for s in query.order_by(models.LeaderboardSnapshot.rank)
+    ]
+    return rank_entries(entries) if group_id is not None else entries
+
+
+def write_snapshot(db: Session, month_start: date) -> list[dict]:
+    """Compute and store the final board for a finished month. Streaks are as of the month's last day."""
+    start, end = month_bounds(month_start)
+    month = month_key(start)
+    month_end = end - timedelta(days=1)
+
+    users = {
+        user_id: username
+        for user_id, username in db.query(models.User.id, models.User.username).filter(models.User.created_at < end)
+    }
+    totals = {
+        user_id: total
+        for user_id, total in db.query(models.UserMonthlyStats.user_id, models.UserMonthlyStats.total_workouts)
+        .filter(models.UserMonthlyStats.month == month)
+    }
+
+    # Streaks as of the month's last day rather than today. Workouts are streamed in
+    # user order and each user's dates are dropped once their streak is computed, so
+    # memory doesn't grow with the total number of workouts.
+    streaks: dict[str, tuple[int, int]] = {}
+    rows = db.query(models.Workout.user_id, models.Workout.date).filter(
+        models.Workout.date < end
+    ).order_by(models.Workout.user_id).yield_per(5000)
+    current_user, dates = None, []
+    for user_id, workout_date in itertools.chain(rows, [(None, None)]):
+        if user_id != current_user:
+            if current_user in users:
+                last_date, run_length, longest = streak_state(dates)
+                streaks[current_user] = (current_streak(last_date, run_length, month_end), longest)
+            current_user, dates = user_id, []
+        dates.append(workout_date)
+
+    entries = []
+    for user_id, username in users.items():
+        streak, longest = streaks.get(user_id, (0, 0))
+        entries.append({
+            "user_id": str(user_id),
+            "username": username,
+            "total_workouts": totals.get(user_id, 0),
+            "current_streak": streak,
+            "longest_streak": longest,
+        })
+    ranked = rank_entries(entries)
+
+    # The month row marks the month as done even when it has no entries
+    db.add(models.LeaderboardMonth(month=month, entries=len(ranked), created_at=datetime.utcnow()))
+    db.add_all([models.LeaderboardSnapshot(month=month, **entry) for entry in ranked])
+    try:
+        db.commit()
+        logger.info("Leaderboard snapshot written", extra={"month": month, "entries": len(ranked)})
+    except IntegrityError:
+        # Another worker snapshotted the same month first; theirs is equivalent
+        db.rollback()
+    return ranked
+
+
+def month_leaderboard(db: Session, month_start: date, today: date, group_id: str = None) -> list[dict]:
+    """Live board for the current month, archived board for past months (snapshotting if needed)"""
+    if month_start >= date(today.year, today.month, 1):
+        return live_leaderboard(db, month_start, today, group_id)
+
+    entries = snapshot_leaderboard(db, month_start, group_id)
+    if entries is not None:
+        return entries
+    # Not archived yet; snapshots are writes, so always use the primary
+    with database.SessionLocal() as primary_db:
+        first_month = first_user_month(primary_db)
+        if first_month is None or month_start < first_month:
+            # Nobody was signed up yet; nothing to rank and nothing worth storing
+            return []
+        ensure_snapshot(primary_db, month_start)
+        return snapshot_leaderboard(primary_db, month_start, group_id) or []
+
+
+def first_user_month(db: Session) -> date | None:
+    first = db.query(func.min(models.User.created_at)).scalar()
+    if first is None:
+        return None
+    if isinstance(first, str):  # SQLite returns aggregates of dates as text
+        first = date.fromisoformat(first)
+    return first.replace(day=1)
+
+
+_month_locks: dict[str, threading.Lock] = {}
+_month_locks_lock = threading.Lock()
+
+
+def ensure_snapshot(db: Session, month_start: date) -> bool:
+    """
+    Snapshot a finished month unless it already is. Returns True if this call wrote it.
+
+    Concurrent first requests for the same month would each scan workouts, so the
+    snapshot is written under a per-month lock: a threading lock within the worker and,
+    on PostgreSQL, a transaction-scoped advisory lock across workers. Whoever waited
+    finds the snapshot already there.
+    """
+    month = month_key(month_start)
+    with _month_locks_lock:
+        lock = _month_locks.setdefault(month, threading.Lock())
+    with lock:
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                {"key": SNAPSHOT_LOCK_KEY + month_start.year * 100 + month_start.month},
+            )
+        if snapshot_leaderboard(db, month_start) is not None:
+            db.rollback()  # Releases the advisory lock
+            return False
+        write_snapshot(db, month_start)  # Commits, releasing the advisory lock
+        return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        logging_config.configure_logging()
+        since = None
+        if "--since" in sys.argv[2:]:
+            since = parse_month(sys.argv[sys.argv.index("--since") + 1])
+        rebuild(since)
+    elif len(sys.argv) > 1 and sys.argv[1] == "snapshot":
+        logging_config.configure_logging()
+        if len(sys.argv) > 2:
+            target = parse_month(sys.argv[2])
+        else:
+            first_of_this_month = date.today().replace(day=1)
+            target = (first_of_this_month - timedelta(days=1)).replace(day=1)
+        with database.SessionLocal() as session:
+            if ensure_snapshot(session, target):
+                print(f"Snapshotted {month_key(target)}: {session.get(models.LeaderboardMonth, month_key(target)).entries} entries")
+            else:
+                print(f"{month_key(target)} already snapshotted")
+    else:
+        print("Usage: python leaderboard.py snapshot [YYYY-MM] | rebuild [--since YYYY-MM]")
+        sys.exit(1)
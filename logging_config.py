@@ -0,0 +1,140 @@
+"""
+Structured logging for the API.
+
+- One JSON object per line (LOG_FORMAT=text for human-readable local output)
+- Every record carries the request id of the request that produced it; the id is
+  taken from the X-Request-ID header or generated, and echoed back in the response
+- DEBUG diagnostics (EXIF dumps, per-step image validation) are sampled per request:
+  LOG_DEBUG_SAMPLE_RATE of requests (default 0.01) log them, the rest only log at
+  LOG_LEVEL (default INFO). Set LOG_DEBUG_SAMPLE_RATE=1 to log them for every request.
+- Records are handed to a background thread through a bounded queue, so request
+  handlers never block on stdout. If the queue is full, records are dropped.
+
+Loggers live under the "workout" namespace (workout.app, workout.startup, ...) so
+that sampling and levels don't touch uvicorn's or third-party loggers.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=False)
+
+# Attributes every LogRecord has; anything else was passed via extra= and is logged as a field
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"workout.{name}")
+
+
+def start_request(request_id: str = None) -> tuple:
+    """Bind a request id and sampling decision to the current context. Returns reset tokens."""
+    request_id = request_id or uuid.uuid4().hex
+    sampled = LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE
+    return request_id_var.set(request_id), sampled_var.set(sampled)
+
+
+def end_request(tokens: tuple):
+    request_id_var.reset(tokens[0])
+    sampled_var.reset(tokens[1])
+
+
+def current_request_id() -> str:
+    return request_id_var.get()
+
+
+def verbose_enabled() -> bool:
+    """True if the current request logs DEBUG diagnostics. Guard expensive debug arguments with this."""
+    return sampled_var.get() or logging.getLevelName(LOG_LEVEL) == logging.DEBUG
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request id and drop unsampled records below LOG_LEVEL"""
+
+    def __init__(self, threshold: int):
+        super().__init__()
+        self.threshold = threshold
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.threshold and not sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of raising when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def configure_logging():
+    """Install the queue handler on the "workout" logger. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    threshold = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(threshold, int):
+        threshold = logging.INFO
+    if LOG_FORMAT == "text":
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+    else:
+        formatter = JsonFormatter()
+
+    # Filtering and formatting happen in the calling thread (the request id lives in
+    # its context); only the write to stdout is moved to the listener thread
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RequestContextFilter(threshold))
+    queue_handler.setFormatter(formatter)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger("workout")
+    root.handlers = [queue_handler]
+    root.setLevel(logging.DEBUG if LOG_DEBUG_SAMPLE_RATE > 0 else threshold)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
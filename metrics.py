@@ -0,0 +1,205 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Metrics are kept per worker process. With several uvicorn workers each one exposes
+its own numbers on /metrics; scrape workers individually (or run one worker per
+container) rather than through a load balancer if you need exact totals.
+
+Usage:
+    with metrics.stage("validate_image_date"):
+        ...
+    metrics.UPLOAD_SIZE_BYTES.observe(len(content))
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPLOAD_SIZE_BUCKETS = tuple(2 ** p for p in range(16, 25))  # 64 KB .. 16 MB
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or computed at scrape time by `callback` (returns {label_values: value})"""
+
+    type = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._callback is not None:
+            try:
+                items = list(self._callback().items())
+            except Exception:
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(counts), total[0]) for k, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            labels = _format_labels(self.label_names, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    labels=("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled by this worker")
+UPLOAD_SIZE_BYTES = Histogram(
+    "upload_size_bytes",
+    "Size of uploaded workout images",
+    buckets=UPLOAD_SIZE_BUCKETS,
+)
+UPLOAD_STAGE_DURATION = Histogram(
+    "upload_stage_duration_seconds",
+    "Time spent in each stage of workout upload processing",
+    labels=("stage",),
+)
+READINESS_CHECK_DURATION = Gauge(
+    "readiness_check_duration_seconds",
+    "Latency of the most recent readiness check, by dependency",
+    labels=("check",),
+)
+
+
+def stage(name: str):
+    """Time a stage of upload processing"""
+    return UPLOAD_STAGE_DURATION.time(stage=name)
+
+
+_db_engines: dict[str, object] = {}
+
+
+def register_db_pool(engine, name: str = "primary"):
+    """Expose connection pool stats of a SQLAlchemy engine, read at scrape time"""
+    _db_engines[name] = engine
+
+
+def _db_pool_stats() -> dict:
+    values = {}
+    for name, engine in list(_db_engines.items()):
+        for stat in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(engine.pool, stat, None)
+            if callable(fn):
+                values[(name, stat)] = fn()
+    return values
+
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "SQLAlchemy connection pool stats",
+    labels=("engine", "stat"),
+    callback=_db_pool_stats,
+)
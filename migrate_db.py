@@ -1,49 +1,274 @@
 """
-Database migration script to add new columns to workouts table.
-Run this once to update your existing database schema.
+Versioned database migrations.
+
+Migrations live in migrations/NNNN_description.py and are applied in order. Each one
+defines:
+
+    revision = "0002"
+    down_revision = "0001"
+    transactional = True        # False for CREATE INDEX CONCURRENTLY / batched backfills
+
+    def upgrade(ctx): ...
+    def downgrade(ctx): ...     # optional
+
+Applied revisions are recorded in the schema_migrations table. The app does not create
+or alter tables itself, so run this on every deploy (release/pre-deploy command):
+
+    python migrate_db.py              # apply pending migrations
+    python migrate_db.py status       # show applied / pending revisions
+    python migrate_db.py downgrade    # revert the most recently applied revision
+
+Online schema changes on PostgreSQL:
+- ctx.create_index() uses CREATE INDEX CONCURRENTLY, so writes to the table are not
+  blocked while the index builds (requires transactional = False)
+- ctx.backfill() updates rows in small committed batches with a pause between them,
+  so no long-running transaction holds row locks on a large table
+- DDL runs with a short lock_timeout, so an ALTER that can't get its lock fails fast
+  instead of queueing every query behind it
+
+On SQLite the same calls fall back to plain CREATE INDEX / batched UPDATEs.
 """
+import glob
+import importlib.util
 import os
-from sqlalchemy import text
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, text
 import database
 
-def migrate_database():
-    """Add missing columns to workouts table if they don't exist"""
-    db = database.SessionLocal()
-    try:
-        # Check if user_id column exists
-        result = db.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='workouts' AND column_name='user_id'
-        """))
-        
-        if result.fetchone() is None:
-            print("Migrating database schema...")
-            
-            # First, we need to handle existing data
-            # Option 1: If you have existing workouts, you might want to delete them
-            # or assign them to a default user. For now, we'll drop the table and recreate.
-            
-            # Drop the old workouts table
-            db.execute(text("DROP TABLE IF EXISTS workouts CASCADE"))
-            db.commit()
-            print("Dropped old workouts table")
-            
-            # Recreate the table with new schema
-            from models import Base, Workout
-            Base.metadata.create_all(bind=database.engine)
-            print("Created new workouts table with user_id, image_url, and notes columns")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Batched backfill defaults (override per call or via environment)
+BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+BACKFILL_PAUSE_SECONDS = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.05"))
+# How long DDL may wait for a table lock on PostgreSQL before giving up
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+
+
+class MigrationContext:
+    """Connection plus dialect-aware helpers handed to each migration's upgrade/downgrade"""
+
+    def __init__(self, connection, transactional: bool):
+        self.connection = connection
+        self.transactional = transactional
+        self.dialect = connection.dialect.name
+        self.is_postgres = self.dialect == "postgresql"
+
+    def execute(self, sql: str, params: dict = None):
+        return self.connection.execute(text(sql), params or {})
+
+    def has_table(self, table: str) -> bool:
+        return inspect(self.connection).has_table(table)
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in {c["name"] for c in inspect(self.connection).get_columns(table)}
+
+    def has_index(self, table: str, name: str) -> bool:
+        return name in {i["name"] for i in inspect(self.connection).get_indexes(table)}
+
+    def add_column(self, table: str, column: str, ddl_type: str):
+        """Add a nullable column (metadata-only on PostgreSQL, no table rewrite)"""
+        if not self.has_column(table, column):
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+    def create_index(self, name: str, table: str, columns: list[str], unique: bool = False):
+        """Create an index without blocking writes (CONCURRENTLY on PostgreSQL)"""
+        columns_sql = ", ".join(columns)
+        unique_sql = "UNIQUE " if unique else ""
+        if not self.is_postgres:
+            self.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns_sql})")
+            return
+
+        if self.transactional:
+            raise RuntimeError(
+                f"create_index({name}) uses CREATE INDEX CONCURRENTLY, which cannot run "
+                "inside a transaction. Set transactional = False in the migration."
+            )
+        # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS
+        # would silently accept, so drop and rebuild it
+        invalid = self.execute(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid",
+            {"name": name},
+        ).first()
+        if invalid:
+            print(f"  Rebuilding invalid index {name}")
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        self.execute(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns_sql})")
+
+    def drop_index(self, name: str):
+        if self.is_postgres and not self.transactional:
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
         else:
-            print("Database schema is up to date")
-            
-    except Exception as e:
-        print(f"Error during migration: {e}")
-        db.rollback()
-        raise
-    finally:
-        db.close()
+            self.execute(f"DROP INDEX IF EXISTS {name}")
 
-if __name__ == "__main__":
-    migrate_database()
-    print("Migration complete!")
+    def backfill(
+        self,
+        table: str,
+        set_sql: str,
+        where_sql: str,
+        params: dict = None,
+        key: str = "id",
+        batch_size: int = None,
+        pause: float = None,
+    ) -> int:
+        """
+        UPDATE table SET set_sql WHERE where_sql, in committed batches of batch_size rows.
+
+        where_sql must stop matching a row once it has been updated (e.g. `col IS NULL`),
+        otherwise this never finishes. Prints progress and sleeps `pause` seconds between
+        batches to leave headroom for production traffic. Returns rows updated.
+        """
+        if self.transactional:
+            raise RuntimeError("backfill() commits per batch; set transactional = False in the migration.")
+        batch_size = batch_size or BACKFILL_BATCH_SIZE
+        pause = BACKFILL_PAUSE_SECONDS if pause is None else pause
+        params = dict(params or {})
+
+        total = self.execute(f"SELECT COUNT(*) FROM {table} WHERE {where_sql}", params).scalar()
+        if not total:
+            return 0
+        print(f"  Backfilling {total} rows in {table} (batch {batch_size}, pause {pause}s)")
 
+        done = 0
+        started = time.perf_counter()
+        while True:
+            result = self.execute(
+                f"UPDATE {table} SET {set_sql} WHERE {key} IN ("
+                f"SELECT {key} FROM {table} WHERE {where_sql} ORDER BY {key} LIMIT :_batch_size)",
+                {**params, "_batch_size": batch_size},
+            )
+            if result.rowcount <= 0:
+                break
+            done += result.rowcount
+            elapsed = time.perf_counter() - started
+            print(f"  {table}: {done}/{total} rows ({done / elapsed:.0f} rows/s)")
+            if pause:
+                time.sleep(pause)
+        return done
+
+
+class Migration:
+    def __init__(self, path: str):
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(f"migrations.{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.name = name
+        self.module = module
+        self.revision = module.revision
+        self.down_revision = getattr(module, "down_revision", None)
+        self.transactional = getattr(module, "transactional", True)
+
+
+def load_migrations() -> list[Migration]:
+    """Load migrations and check they form a single linear chain"""
+    migrations = [Migration(p) for p in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "[0-9]*.py")))]
+    previous = None
+    for migration in migrations:
+        if migration.down_revision != previous:
+            raise RuntimeError(
+                f"Migration {migration.name} has down_revision {migration.down_revision!r}, "
+                f"expected {previous!r}"
+            )
+        previous = migration.revision
+    return migrations
+
+
+def ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "revision VARCHAR PRIMARY KEY, applied_at VARCHAR NOT NULL)"
+        ))
+
+
+def applied_revisions(engine) -> set[str]:
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT revision FROM schema_migrations"))}
+
+
+def run_migration(engine, migration: Migration, direction: str):
+    fn = getattr(migration.module, direction, None)
+    if fn is None:
+        raise RuntimeError(f"Migration {migration.name} has no {direction}()")
+
+    if migration.transactional:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            fn(MigrationContext(conn, transactional=True))
+            record_revision(conn, migration, direction)
+    else:
+        with engine.connect() as raw_conn:
+            conn = raw_conn.execution_options(isolation_level="AUTOCOMMIT")
+            if conn.dialect.name == "postgresql":
+                conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+            fn(MigrationContext(conn, transactional=False))
+            record_revision(conn, migration, direction)
+
+
+def record_revision(conn, migration: Migration, direction: str):
+    if direction == "upgrade":
+        conn.execute(
+            text("INSERT INTO schema_migrations (revision, applied_at) VALUES (:revision, :applied_at)"),
+            {"revision": migration.revision, "applied_at": datetime.utcnow().isoformat()},
+        )
+    else:
+        conn.execute(text("DELETE FROM schema_migrations WHERE revision = :revision"), {"revision": migration.revision})
+
+
+def migrate_database(engine=None):
+    """Apply all pending migrations in order"""
+    engine = engine or database.engine
+    ensure_version_table(engine)
+    applied = applied_revisions(engine)
+    pending = [m for m in load_migrations() if m.revision not in applied]
+    if not pending:
+        print("Database schema is up to date")
+        return
+    for migration in pending:
+        print(f"Applying {migration.name}...")
+        started = time.perf_counter()
+        run_migration(engine, migration, "upgrade")
+        print(f"Applied {migration.name} in {time.perf_counter() - started:.2f}s")
+
+
+def downgrade_database(engine=None):
+    """Revert the most recently applied migration"""
+    engine = engine or database.engine
+    ensure_version_table(engine)
+    applied = applied_revisions(engine)
+    done = [m for m in load_migrations() if m.revision in applied]
+    if not done:
+        print("No migrations to revert")
+        return
+    migration = done[-1]
+    print(f"Reverting {migration.name}...")
+    run_migration(engine, migration, "downgrade")
+    print(f"Reverted {migration.name}")
+
+
+def print_status(engine=None):
+    engine = engine or database.engine
+    ensure_version_table(engine)
+    applied = applied_revisions(engine)
+    for migration in load_migrations():
+        state = "applied" if migration.revision in applied else "pending"
+        print(f"{migration.name:<40} {state}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        migrate_database()
+        print("Migration complete!")
+    elif command == "downgrade":
+        downgrade_database()
+    elif command == "status":
+        print_status()
+    else:
+        print(f"Unknown command: {command}. Use upgrade, downgrade or status.")
+        sys.exit(1)
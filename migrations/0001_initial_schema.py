@@ -0,0 +1,62 @@
+"""
+Initial schema: users and workouts.
+
+Databases created before versioned migrations (by create_all at app startup) already
+have these tables; checkfirst makes this a no-op for them so they just get stamped.
+A workouts table from the old single-user schema (no user_id) is renamed to
+workouts_legacy instead of being dropped, so its data can still be recovered.
+"""
+from sqlalchemy import Column, Date, ForeignKey, MetaData, String, Table, UniqueConstraint
+
+revision = "0001"
+down_revision = None
+
+metadata = MetaData()
+
+users = Table(
+    "users",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("username", String, unique=True, nullable=False, index=True),
+    Column("email", String, unique=True, nullable=True, index=True),
+    Column("hashed_password", String, nullable=False),
+    Column("created_at", Date, nullable=False),
+)
+
+workouts = Table(
+    "workouts",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False, index=True),
+    Column("date", Date, nullable=False, index=True),
+    Column("image_url", String, nullable=False),
+    Column("notes", String, nullable=True),
+    UniqueConstraint("user_id", "date", name="unique_user_workout_date"),
+)
+
+
+def upgrade(ctx):
+    if ctx.has_table("workouts") and not ctx.has_column("workouts", "user_id"):
+        print("  Renaming single-user workouts table to workouts_legacy")
+        ctx.execute("ALTER TABLE workouts RENAME TO workouts_legacy")
+        # Free the old index names so the new table can use them
+        if ctx.is_postgres:
+            ctx.execute("ALTER INDEX IF EXISTS ix_workouts_date RENAME TO ix_workouts_legacy_date")
+        else:
+            # SQLite can't rename indexes and keeps them on the renamed table; recreate
+            # each one under a legacy name
+            indexes = ctx.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = 'workouts_legacy' AND sql IS NOT NULL"
+            ).fetchall()
+            for name, sql in indexes:
+                legacy_name = name.replace("workouts", "workouts_legacy", 1)
+                if legacy_name == name:
+                    continue
+                ctx.execute(f'DROP INDEX "{name}"')
+                ctx.execute(sql.replace(name, legacy_name, 1))
+    metadata.create_all(bind=ctx.connection, checkfirst=True)
+
+
+def downgrade(ctx):
+    metadata.drop_all(bind=ctx.connection, checkfirst=True)
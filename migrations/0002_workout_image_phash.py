@@ -0,0 +1,25 @@
+"""
+Perceptual hash chunks on workouts, for detecting reused selfies (see phash.py).
+
+Columns are nullable so adding them doesn't rewrite the table; indexes are built
+concurrently. Existing rows are hashed by `python phash.py backfill`, which needs
+the image files and so isn't part of the migration.
+"""
+revision = "0002"
+down_revision = "0001"
+transactional = False
+
+
+def upgrade(ctx):
+    for i in range(4):
+        ctx.add_column("workouts", f"phash_{i}", "INTEGER")
+    for i in range(4):
+        # (chunk, user_id) serves both the per-user and the global lookup
+        ctx.create_index(f"ix_workouts_phash_{i}", "workouts", [f"phash_{i}", "user_id"])
+
+
+def downgrade(ctx):
+    for i in range(4):
+        ctx.drop_index(f"ix_workouts_phash_{i}")
+    for i in range(4):
+        ctx.execute(f"ALTER TABLE workouts DROP COLUMN phash_{i}")
@@ -0,0 +1,38 @@
+"""
+upload_jobs table: the queue for accept-then-process uploads (see jobs.py).
+"""
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, MetaData, String, Table, UniqueConstraint
+
+revision = "0003"
+down_revision = "0002"
+
+metadata = MetaData()
+
+# Referenced by the foreign key; not created here
+Table("users", metadata, Column("id", String, primary_key=True))
+
+upload_jobs = Table(
+    "upload_jobs",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False, index=True),
+    Column("idempotency_key", String, nullable=True),
+    Column("status", String, nullable=False),
+    Column("workout_date", Date, nullable=False),
+    Column("temp_path", String, nullable=False),
+    Column("notes", String, nullable=True),
+    Column("error", String, nullable=True),
+    Column("workout_id", String, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    UniqueConstraint("user_id", "idempotency_key", name="unique_user_idempotency_key"),
+    Index("ix_upload_jobs_status_created_at", "status", "created_at"),
+)
+
+
+def upgrade(ctx):
+    upload_jobs.create(bind=ctx.connection, checkfirst=True)
+
+
+def downgrade(ctx):
+    upload_jobs.drop(bind=ctx.connection, checkfirst=True)
@@ -0,0 +1,124 @@
+"""
+Per-user aggregates, monthly leaderboard snapshots and groups (see leaderboard.py).
+
+Aggregates for existing workouts are backfilled here: monthly counts with one
+INSERT ... SELECT, streaks with a single ordered pass over workouts. Runs outside a
+transaction (each statement commits), and skips users that already have rows, so
+an interrupted run can simply be re-run.
+"""
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table
+
+revision = "0004"
+down_revision = "0003"
+transactional = False
+
+BATCH_SIZE = 1000
+
+metadata = MetaData()
+
+# Referenced by foreign keys; not created here
+Table("users", metadata, Column("id", String, primary_key=True))
+
+user_monthly_stats = Table(
+    "user_monthly_stats",
+    metadata,
+    Column("user_id", String, ForeignKey("users.id"), primary_key=True),
+    Column("month", String, primary_key=True, index=True),
+    Column("total_workouts", Integer, nullable=False),
+)
+
+user_streaks = Table(
+    "user_streaks",
+    metadata,
+    Column("user_id", String, ForeignKey("users.id"), primary_key=True),
+    Column("last_workout_date", Date, nullable=True),
+    Column("run_length", Integer, nullable=False),
+    Column("longest_streak", Integer, nullable=False),
+)
+
+leaderboard_snapshots = Table(
+    "leaderboard_snapshots",
+    metadata,
+    Column("month", String, primary_key=True),
+    Column("user_id", String, primary_key=True),
+    Column("username", String, nullable=False),
+    Column("rank", Integer, nullable=False),
+    Column("total_workouts", Integer, nullable=False),
+    Column("current_streak", Integer, nullable=False),
+    Column("longest_streak", Integer, nullable=False),
+)
+
+groups = Table(
+    "groups",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("created_by", String, ForeignKey("users.id"), nullable=False),
+    Column("created_at", Date, nullable=False),
+)
+
+group_members = Table(
+    "group_members",
+    metadata,
+    Column("group_id", String, ForeignKey("groups.id"), primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), primary_key=True, index=True),
+    Column("joined_at", Date, nullable=False),
+)
+
+TABLES = [user_monthly_stats, user_streaks, leaderboard_snapshots, groups, group_members]
+
+
+def upgrade(ctx):
+    for table in TABLES:
+        table.create(bind=ctx.connection, checkfirst=True)
+
+    month_expr = "to_char(date, 'YYYY-MM')" if ctx.is_postgres else "strftime('%Y-%m', date)"
+    ctx.execute(
+        "INSERT INTO user_monthly_stats (user_id, month, total_workouts) "
+        f"SELECT user_id, {month_expr}, COUNT(*) FROM workouts "
+        "WHERE user_id NOT IN (SELECT user_id FROM user_monthly_stats) "
+        f"GROUP BY user_id, {month_expr}"
+    )
+
+    # Streaks need the dates in order, so walk workouts once per user and insert in batches
+    rows = ctx.execute(
+        "SELECT user_id, date FROM workouts "
+        "WHERE user_id NOT IN (SELECT user_id FROM user_streaks) ORDER BY user_id, date"
+    )
+    batch = []
+    done = 0
+    started = time.perf_counter()
+    current = None
+    for user_id, workout_date in rows:
+        if isinstance(workout_date, str):
+            workout_date = date.fromisoformat(workout_date)
+        if current is None or current["u"] != user_id:
+            if current is not None:
+                batch.append(current)
+            current = {"u": user_id, "d": None, "r": 0, "l": 0}
+        if current["d"] is not None and workout_date == current["d"] + timedelta(days=1):
+            current["r"] += 1
+        elif workout_date != current["d"]:
+            current["r"] = 1
+        current["l"] = max(current["l"], current["r"])
+        current["d"] = workout_date
+    if current is not None:
+        batch.append(current)
+
+    for start in range(0, len(batch), BATCH_SIZE):
+        chunk = batch[start:start + BATCH_SIZE]
+        ctx.execute(
+            "INSERT INTO user_streaks (user_id, last_workout_date, run_length, longest_streak) "
+            "VALUES (:u, :d, :r, :l)",
+            chunk,
+        )
+        done += len(chunk)
+        print(f"  user_streaks: {done}/{len(batch)} users ({done / (time.perf_counter() - started):.0f} users/s)")
+
+
+def downgrade(ctx):
+    for table in reversed(TABLES):
+        table.drop(bind=ctx.connection, checkfirst=True)
@@ -0,0 +1,32 @@
+"""
+leaderboard_months: marks a month as snapshotted, so a month with no entries isn't
+recomputed on every request (see leaderboard.py). Months already in
+leaderboard_snapshots are marked as done.
+"""
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+revision = "0005"
+down_revision = "0004"
+
+metadata = MetaData()
+
+leaderboard_months = Table(
+    "leaderboard_months",
+    metadata,
+    Column("month", String, primary_key=True),
+    Column("entries", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+
+def upgrade(ctx):
+    leaderboard_months.create(bind=ctx.connection, checkfirst=True)
+    ctx.execute(
+        "INSERT INTO leaderboard_months (month, entries, created_at) "
+        "SELECT month, COUNT(*), CURRENT_TIMESTAMP FROM leaderboard_snapshots "
+        "WHERE month NOT IN (SELECT month FROM leaderboard_months) GROUP BY month"
+    )
+
+
+def downgrade(ctx):
+    leaderboard_months.drop(bind=ctx.connection, checkfirst=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Date, String, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Date, DateTime, Index, Integer, String, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 import uuid
 from database import Base
@@ -19,8 +19,90 @@ class Workout(Base):
     date = Column(Date, nullable=False, index=True)
     image_url = Column(String, nullable=False)  # Required: gym selfie
     notes = Column(String, nullable=True)  # Optional: workout notes
+    # Perceptual hash of the image as four 16-bit chunks (see phash.py)
+    phash_0 = Column(Integer, nullable=True)
+    phash_1 = Column(Integer, nullable=True)
+    phash_2 = Column(Integer, nullable=True)
+    phash_3 = Column(Integer, nullable=True)
     
     # Unique constraint: each user can only have one workout per date
     __table_args__ = (
         UniqueConstraint('user_id', 'date', name='unique_user_workout_date'),
+        Index('ix_workouts_phash_0', 'phash_0', 'user_id'),
+        Index('ix_workouts_phash_1', 'phash_1', 'user_id'),
+        Index('ix_workouts_phash_2', 'phash_2', 'user_id'),
+        Index('ix_workouts_phash_3', 'phash_3', 'user_id'),
     )
+
+
+# Queue of accepted-but-unprocessed uploads (see jobs.py)
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    idempotency_key = Column(String, nullable=True)  # Optional: from the Idempotency-Key header
+    status = Column(String, nullable=False)  # pending, processing, succeeded, failed
+    workout_date = Column(Date, nullable=False)
+    temp_path = Column(String, nullable=False)
+    notes = Column(String, nullable=True)
+    error = Column(String, nullable=True)  # User-facing rejection message
+    workout_id = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'idempotency_key', name='unique_user_idempotency_key'),
+        Index('ix_upload_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+
+# Per-user aggregates maintained on every workout write (see leaderboard.py)
+class UserMonthlyStats(Base):
+    __tablename__ = "user_monthly_stats"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    month = Column(String, primary_key=True, index=True)  # YYYY-MM
+    total_workouts = Column(Integer, nullable=False, default=0)
+
+
+class UserStreak(Base):
+    __tablename__ = "user_streaks"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    last_workout_date = Column(Date, nullable=True)
+    run_length = Column(Integer, nullable=False, default=0)  # Consecutive days ending on last_workout_date
+    longest_streak = Column(Integer, nullable=False, default=0)
+
+
+# Final leaderboard of a finished month
+class LeaderboardSnapshot(Base):
+    __tablename__ = "leaderboard_snapshots"
+    month = Column(String, primary_key=True)  # YYYY-MM
+    user_id = Column(String, primary_key=True)
+    username = Column(String, nullable=False)
+    rank = Column(Integer, nullable=False)
+    total_workouts = Column(Integer, nullable=False)
+    current_streak = Column(Integer, nullable=False)
+    longest_streak = Column(Integer, nullable=False)
+
+
+# Months that have been snapshotted (also those with no entries)
+class LeaderboardMonth(Base):
+    __tablename__ = "leaderboard_months"
+    month = Column(String, primary_key=True)  # YYYY-MM
+    entries = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+# Friends/teams with their own leaderboard
+class Group(Base):
+    __tablename__ = "groups"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    created_by = Column(String, ForeignKey("users.id"), nullable=False)
+    created_at = Column(Date, nullable=False)
+
+
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    group_id = Column(String, ForeignKey("groups.id"), primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True, index=True)
+    joined_at = Column(Date, nullable=False)
@@ -0,0 +1,198 @@
+"""
+Perceptual hashing to catch re-uploaded gym selfies.
+
+Each accepted image gets a 64-bit difference hash (dHash): the image is shrunk to 9x8
+grayscale and each bit records whether a pixel is brighter than its right neighbour.
+Re-saved, resized or recompressed copies of the same photo land within a few bits of
+each other, so "same photo" means Hamming distance <= PHASH_MAX_DISTANCE.
+
+Lookup uses multi-index hashing so it never scans past uploads. The hash is stored as
+four 16-bit chunks (workouts.phash_0 .. phash_3), each with its own index. If two
+hashes differ in at most r bits, at least one chunk differs in at most r // 4 bits
+(pigeonhole), so it is enough to look up, per chunk, every value within r // 4 bits of
+the new chunk and check the few rows that come back. With r <= 7 that is 17 indexed
+values per chunk.
+
+Chunk values are not spread evenly, though: flat image regions (walls, sky, a dark
+corner) hash to all-zero or all-one chunks, and those buckets grow with the table. A
+chunk whose probes would reach 0x0000 or 0xFFFF is therefore not probed; the pigeonhole
+argument still holds over the remaining chunks with a larger per-chunk radius
+(r // chunks used). If no chunk is usable (a nearly uniform image), all four are probed
+anyway. Either way at most PHASH_MAX_CANDIDATES rows are fetched, so a lookup stays
+bounded; with global scope on a very large table that cap can make a match be missed
+rather than the lookup becoming slow.
+
+Backfill hashes for workouts uploaded before this existed:
+    python phash.py backfill
+"""
+import itertools
+import os
+import sys
+
+from PIL import Image, ImageOps
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+import logging_config
+import models
+
+logger = logging_config.get_logger("phash")
+
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Above 11 the number of probes per chunk grows quickly (r // 4 = 3 -> 697 values)
+MAX_SUPPORTED_DISTANCE = 11
+MAX_CHUNK_RADIUS = 3
+DEGENERATE_CHUNKS = (0, CHUNK_MASK)
+
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "true").lower() == "true"
+PHASH_MAX_DISTANCE = min(int(os.getenv("PHASH_MAX_DISTANCE", "6")), MAX_SUPPORTED_DISTANCE)
+# "user": only compare against the uploader's own history. "global": all users.
+PHASH_SCOPE = os.getenv("PHASH_SCOPE", "user")
+# Upper bound on rows checked per lookup
+PHASH_MAX_CANDIDATES = int(os.getenv("PHASH_MAX_CANDIDATES", "1000"))
+
+
+def dhash(image_path: str) -> int:
+    """64-bit difference hash of an image file"""
+    with Image.open(image_path) as img:
+        # For JPEGs, let the decoder downscale while decoding instead of decoding full size
+        img.draft("L", (64, 64))
+        # Apply the EXIF rotation so a copy re-exported with it baked in hashes the same
+        img = ImageOps.exif_transpose(img)
+        small = img.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def split_chunks(value: int) -> list[int]:
+    """Split a 64-bit hash into four 16-bit chunks, most significant first"""
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def join_chunks(chunks) -> int:
+    value = 0
+    for chunk in chunks:
+        value = (value << CHUNK_BITS) | chunk
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def chunk_probes(chunk: int, radius: int) -> list[int]:
+    """All 16-bit values within `radius` bits of chunk"""
+    probes = [chunk]
+    for flips in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), flips):
+            probe = chunk
+            for bit in bits:
+                probe ^= 1 << bit
+            probes.append(probe)
+    return probes
+
+
+def probe_plan(chunks: list[int], max_distance: int) -> list[tuple[int, int]]:
+    """
+    (chunk index, radius) pairs to probe. Skips chunks within radius of an all-zero or
+    all-one value, widening the radius of the rest so a match within max_distance is
+    still guaranteed to share a probed value.
+    """
+    usable = list(range(CHUNKS))
+    while usable:
+        radius = max_distance // len(usable)
+        if radius > MAX_CHUNK_RADIUS:
+            break
+        kept = [
+            i for i in usable
+            if all(hamming(chunks[i], d) > radius for d in DEGENERATE_CHUNKS)
+        ]
+        if kept == usable:
+            return [(i, radius) for i in usable]
+        usable = kept
+    # Nearly uniform image: nothing better than probing everything (candidates are capped)
+    return [(i, max_distance // CHUNKS) for i in range(CHUNKS)]
+
+
+def chunk_columns():
+    return [models.Workout.phash_0, models.Workout.phash_1, models.Workout.phash_2, models.Workout.phash_3]
+
+
+def find_similar(
+    db: Session,
+    value: int,
+    user_id: str = None,
+    max_distance: int = PHASH_MAX_DISTANCE,
+) -> models.Workout | None:
+    """Closest stored workout image within max_distance bits, or None"""
+    max_distance = min(max_distance, MAX_SUPPORTED_DISTANCE)
+    chunks = split_chunks(value)
+    columns = chunk_columns()
+    conditions = [
+        columns[i].in_(chunk_probes(chunks[i], radius))
+        for i, radius in probe_plan(chunks, max_distance)
+    ]
+    query = db.query(models.Workout.id, *columns).filter(or_(*conditions))
+    if user_id is not None:
+        query = query.filter(models.Workout.user_id == user_id)
+
+    best = None
+    best_distance = max_distance + 1
+    rows = query.limit(PHASH_MAX_CANDIDATES).all()
+    if len(rows) == PHASH_MAX_CANDIDATES:
+        logger.warning("Perceptual hash lookup hit the candidate limit", extra={"limit": PHASH_MAX_CANDIDATES})
+    for row in rows:
+        distance = hamming(value, join_chunks(row[1:]))
+        if distance < best_distance:
+            best, best_distance = row.id, distance
+    if best is None:
+        return None
+    logger.info("Similar image found", extra={"workout_id": best, "distance": best_distance})
+    return db.get(models.Workout, best)
+
+
+def backfill(batch_size: int = 500, upload_dir: str = "uploads"):
+    """Compute hashes for stored workouts that don't have one yet"""
+    import database
+
+    db = database.SessionLocal()
+    done = failed = 0
+    last_id = ""
+    try:
+        while True:
+            workouts = db.query(models.Workout).filter(
+                models.Workout.phash_0.is_(None),
+                models.Workout.id > last_id,
+            ).order_by(models.Workout.id).limit(batch_size).all()
+            if not workouts:
+                break
+            for workout in workouts:
+                last_id = workout.id
+                path = workout.image_url.replace("/uploads/", upload_dir + "/", 1)
+                try:
+                    workout.phash_0, workout.phash_1, workout.phash_2, workout.phash_3 = split_chunks(dhash(path))
+                    done += 1
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    logger.warning("Could not hash %s: %s", path, e)
+            db.commit()
+            print(f"Hashed {done} images ({failed} failed)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        logging_config.configure_logging()
+        backfill()
+    else:
+        print("Usage: python phash.py backfill")
+        sys.exit(1)
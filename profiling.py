@@ -0,0 +1,237 @@
+"""
+On-demand profiling for live workers. Disabled unless PROFILING_TOKEN is set; with it
+unset no middleware is installed and the /debug endpoints return 404.
+
+CPU: a sampling profiler. While at least one profiled request is in flight, a
+background thread records the stacks of every busy thread in this worker every
+PROFILE_SAMPLE_INTERVAL seconds (default 5 ms). Nothing is traced per call, so the
+profiled request runs at close to normal speed. Stacks of threads that are just
+waiting (event loop select, idle thread pool workers) are skipped; other requests
+running concurrently on the same worker do show up.
+
+Profile a request by sending `X-Profile: <PROFILING_TOKEN>`; the response carries
+X-Profile-Id. Or sample a share of all requests with
+POST /debug/profiling {"sample_percent": 5}; those are merged into one profile,
+id "sampled". Profiles are kept in memory (last PROFILE_MAX_STORED) and served by
+GET /debug/profiles/{id} in collapsed-stack format ("frame;frame;frame count" per
+line), which flamegraph.pl and speedscope.app read directly.
+
+Memory: tracemalloc, started and snapshotted on demand. The first snapshot after
+start is the baseline; later snapshots report the top allocation sites and what
+grew since the baseline.
+
+Everything is per worker process, like /metrics.
+"""
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+
+import logging_config
+
+logger = logging_config.get_logger("profiling")
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "20"))
+PROFILE_MAX_DEPTH = 64
+
+SAMPLED_PROFILE_ID = "sampled"
+
+# Leaf frames of threads that are waiting rather than working
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+def enabled() -> bool:
+    return bool(PROFILING_TOKEN)
+
+
+def check_token(value: str) -> bool:
+    """Constant-time comparison against PROFILING_TOKEN (always False when disabled)"""
+    return enabled() and value is not None and hmac.compare_digest(value, PROFILING_TOKEN)
+
+
+class Profile:
+    def __init__(self, profile_id: str, label: str):
+        self.id = profile_id
+        self.label = label
+        self.started_at = time.time()
+        self.seconds = 0.0
+        self.requests = 0
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add_samples(self, stacks: list[str]):
+        with self._lock:
+            self.samples.update(stacks)
+
+    def add_request(self, seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.seconds += seconds
+
+    def collapsed(self) -> str:
+        with self._lock:
+            counts = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in counts)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "label": self.label,
+                "started_at": self.started_at,
+                "seconds": round(self.seconds, 3),
+                "requests": self.requests,
+                "samples": sum(self.samples.values()),
+            }
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(thread_name: str, frame) -> str | None:
+    """Root-first stack as 'thread;file:func;...', or None if the thread is idle"""
+    if os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+        return None
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """One sampling thread per worker, running only while profiles are active"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._active: dict[int, Profile] = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self, profile: Profile) -> int:
+        with self._lock:
+            token = next(self._tokens)
+            self._active[token] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        return token
+
+    def end(self, token: int):
+        with self._lock:
+            self._active.pop(token, None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._active.values())
+                if not profiles:
+                    self._thread = None
+                    return
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = _collapse(names.get(ident, str(ident)), frame)
+                if stack is not None:
+                    stacks.append(stack)
+            for profile in profiles:
+                profile.add_samples(stacks)
+
+
+sampler = Sampler()
+_profiles: OrderedDict[str, Profile] = OrderedDict()
+_profiles_lock = threading.Lock()
+sample_percent = 0.0
+
+
+def set_sample_percent(percent: float):
+    """Profile `percent` of requests into the 'sampled' profile (restarted on every change)"""
+    global sample_percent
+    sample_percent = max(0.0, min(percent, 100.0))
+    with _profiles_lock:
+        _profiles.pop(SAMPLED_PROFILE_ID, None)
+        if sample_percent > 0:
+            _profiles[SAMPLED_PROFILE_ID] = Profile(SAMPLED_PROFILE_ID, f"{sample_percent:g}% of requests")
+    logger.info("Profiling sample rate changed", extra={"sample_percent": sample_percent})
+
+
+def profile_for_request(header_value: str, label: str) -> Profile | None:
+    """The profile this request should feed, if any"""
+    if header_value is not None and check_token(header_value):
+        profile = Profile(uuid.uuid4().hex[:12], label)
+        with _profiles_lock:
+            _profiles[profile.id] = profile
+            while len(_profiles) > PROFILE_MAX_STORED:
+                oldest = next(k for k in _profiles if k != SAMPLED_PROFILE_ID)
+                del _profiles[oldest]
+        return profile
+    if sample_percent > 0 and random.random() * 100 < sample_percent:
+        with _profiles_lock:
+            return _profiles.get(SAMPLED_PROFILE_ID)
+    return None
+
+
+def list_profiles() -> list[dict]:
+    with _profiles_lock:
+        return [p.summary() for p in reversed(_profiles.values())]
+
+
+def get_profile(profile_id: str) -> Profile | None:
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+_baseline = None
+
+
+def tracemalloc_start(frames: int = 10):
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        logger.info("tracemalloc started", extra={"frames": frames})
+    _baseline = None
+
+
+def tracemalloc_stop():
+    global _baseline
+    tracemalloc.stop()
+    _baseline = None
+    logger.info("tracemalloc stopped")
+
+
+def tracemalloc_report(limit: int = 25, group_by: str = "lineno") -> str:
+    """Top allocation sites now, and growth since the baseline (the first snapshot after start)"""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced: {current / 1024 / 1024:.1f} MB current, {peak / 1024 / 1024:.1f} MB peak", ""]
+
+    lines.append(f"Top {limit} allocation sites:")
+    lines.extend(str(stat) for stat in snapshot.statistics(group_by)[:limit])
+    if _baseline is None:
+        _baseline = snapshot
+        lines += ["", "Saved as baseline; take another snapshot to see growth."]
+    else:
+        lines += ["", f"Top {limit} changes since baseline:"]
+        lines.extend(str(stat) for stat in snapshot.compare_to(_baseline, group_by)[:limit])
+    return "\n".join(lines) + "\n"
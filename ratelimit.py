@@ -0,0 +1,182 @@
+"""
+Rate limiting and admission control for expensive endpoints.
+
+- RateLimiter: token bucket per key (user id or client IP). Over the limit -> 429.
+- ConcurrencyLimiter: caps how many expensive operations (bcrypt, image decoding,
+  face detection) run at once in this worker. No free slot -> 503.
+
+Both responses carry a Retry-After header so clients back off instead of retrying
+immediately.
+
+Buckets live in process memory by default. With several workers, set
+RATE_LIMIT_BACKEND=redis and REDIS_URL (any Redis-compatible server) so all
+workers share the same buckets. Requires `pip install redis`.
+"""
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException, Request, status
+
+import logging_config
+
+logger = logging_config.get_logger("ratelimit")
+
+# Try to import redis for the shared backend, but make it optional
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Only trust X-Forwarded-For when running behind a proxy that sets it (Render, Heroku, nginx)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+
+class InMemoryBackend:
+    """Token buckets stored in a dict. Limits apply per worker process."""
+
+    # How often to drop buckets that have refilled completely, to bound memory
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self):
+        # key -> (tokens, updated, expires_at); expires_at is when the bucket will have
+        # refilled completely, after which dropping it changes nothing
+        self._buckets: dict[str, tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def take(self, key: str, rate: float, capacity: int) -> tuple[bool, float]:
+        """Take one token. Returns (allowed, seconds_until_next_token)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (float(capacity), now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if now - self._last_prune > self.PRUNE_INTERVAL:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now: float):
+        self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        self._last_prune = now
+
+
+class RedisBackend:
+    """Token buckets stored in Redis hashes, shared by all workers"""
+
+    # Refill and take atomically on the server, using the server clock so workers
+    # with skewed clocks agree. Retry-after is returned as a string because Redis
+    # truncates Lua numbers to integers.
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url: str):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key: str, rate: float, capacity: int) -> tuple[bool, float]:
+        try:
+            allowed, retry_after = self._script(keys=[f"ratelimit:{key}"], args=[rate, capacity])
+        except redis.RedisError as e:
+            # Fail open: an unavailable limiter must not take the API down with it
+            logger.warning("Rate limiter backend unavailable, allowing request: %s", e)
+            return True, 0.0
+        return bool(allowed), float(retry_after)
+
+
+def create_backend():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisBackend(REDIS_URL)
+    return InMemoryBackend()
+
+
+backend = create_backend()
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    """Token bucket limit: `per_minute` sustained rate with bursts of up to `burst`"""
+
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst
+
+    def hit(self, key: str):
+        """Consume one token for key, raising 429 if the bucket is empty"""
+        if not RATE_LIMIT_ENABLED:
+            return
+        allowed, retry_after = backend.take(f"{self.name}:{key}", self.rate, self.burst)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please slow down and try again shortly.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    def by_ip(self, request: Request):
+        """FastAPI dependency limiting by client IP"""
+        self.hit(f"ip:{client_ip(request)}")
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent expensive operations in this worker; sheds excess load with 503"""
+
+    def __init__(self, name: str, max_concurrent: int, retry_after: int = 2):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        # A threading semaphore works for both sync (threadpool) and async handlers
+        # because we never block on it
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def slot(self):
+        """FastAPI dependency holding a slot for the duration of the request"""
+        if not self._semaphore.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy. Please try again in a moment.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,43 @@
+"""
+Worker startup measurements.
+
+Import this module before anything else in app.py so the timer covers the cost of
+importing FastAPI, SQLAlchemy, Pillow and the app itself.
+"""
+import os
+import resource
+import sys
+import time
+
+_import_started = time.perf_counter()
+
+import logging_config
+
+logger = logging_config.get_logger("startup")
+
+
+def resident_memory_mb() -> float:
+    """Current resident set size of this process in MB (peak RSS if /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KB on Linux and bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def startup_seconds() -> float:
+    """Seconds since this module was imported"""
+    return time.perf_counter() - _import_started
+
+
+def report_ready():
+    """Log startup time and resident memory once the worker is ready to serve"""
+    seconds = startup_seconds()
+    rss_mb = resident_memory_mb()
+    logger.info(
+        "Worker %s ready in %.3fs, RSS %.1f MB", os.getpid(), seconds, rss_mb,
+        extra={"startup_seconds": round(seconds, 3), "rss_mb": round(rss_mb, 1), "cv2_loaded": "cv2" in sys.modules},
+    )
@@ -0,0 +1,203 @@
+"""
+Garbage collection for UPLOAD_DIR.
+
+Two kinds of files pile up there:
+- temp_* files from uploads that never finished (worker crash, cancelled request)
+- images no workout references any more (a failed delete, a crash between moving the
+  image into place and committing the workout)
+
+The collector scans the directory with os.scandir (no full listing in memory) and
+checks names against the database in batches of UPLOAD_GC_BATCH_SIZE with one
+`IN (...)` query per batch:
+- temp files older than UPLOAD_GC_TEMP_MAX_AGE seconds are removed, unless a pending
+  or processing upload job still points at them
+- other files not referenced by any workouts.image_url are removed once they are older
+  than UPLOAD_GC_ORPHAN_GRACE seconds (an upload moves its image into place just
+  before committing the workout)
+
+Lookups always go to the primary; a lagging replica could make a live image look
+unreferenced.
+
+    python upload_gc.py run [--dry-run]   # one pass, prints what it removed
+    python upload_gc.py loop              # every UPLOAD_GC_INTERVAL seconds (separate process)
+
+UPLOAD_GC_INTERVAL > 0 also runs it in a background thread of each API worker.
+"""
+import os
+import sys
+import threading
+import time
+
+import database
+import jobs
+import logging_config
+import metrics
+import models
+
+logger = logging_config.get_logger("upload_gc")
+
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "0"))
+UPLOAD_GC_TEMP_MAX_AGE = float(os.getenv("UPLOAD_GC_TEMP_MAX_AGE", str(6 * 3600)))
+UPLOAD_GC_ORPHAN_GRACE = float(os.getenv("UPLOAD_GC_ORPHAN_GRACE", "3600"))
+UPLOAD_GC_BATCH_SIZE = int(os.getenv("UPLOAD_GC_BATCH_SIZE", "500"))
+
+TEMP_PREFIX = "temp_"
+
+UPLOAD_GC_REMOVED = metrics.Counter(
+    "upload_gc_removed_files_total",
+    "Files removed from UPLOAD_DIR by the garbage collector",
+    labels=("kind",),
+)
+UPLOAD_GC_REMOVED_BYTES = metrics.Counter(
+    "upload_gc_removed_bytes_total",
+    "Bytes freed in UPLOAD_DIR by the garbage collector",
+)
+
+
+def referenced_temp_paths(db, paths: list[str]) -> set[str]:
+    """Temp paths still owned by a pending/processing upload job"""
+    rows = db.query(models.UploadJob.temp_path).filter(
+        models.UploadJob.temp_path.in_(paths),
+        models.UploadJob.status.in_([jobs.PENDING, jobs.PROCESSING]),
+    )
+    return {row[0] for row in rows}
+
+
+def referenced_image_urls(db, urls: list[str]) -> set[str]:
+    rows = db.query(models.Workout.image_url).filter(models.Workout.image_url.in_(urls))
+    return {row[0] for row in rows}
+
+
+def collect(upload_dir: str = "uploads", dry_run: bool = False) -> dict:
+    """One pass over upload_dir. Returns counts of what was scanned and removed."""
+    stats = {"scanned": 0, "temp_removed": 0, "orphans_removed": 0, "bytes_freed": 0, "errors": 0}
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    try:
+        temp_batch: list[tuple[str, int]] = []
+        image_batch: list[tuple[str, int]] = []
+        now = time.time()
+        with os.scandir(upload_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                stats["scanned"] += 1
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue  # Removed while we were scanning
+                age = now - st.st_mtime
+                if entry.name.startswith(TEMP_PREFIX):
+                    if age > UPLOAD_GC_TEMP_MAX_AGE:
+                        temp_batch.append((entry.name, st.st_size))
+                elif age > UPLOAD_GC_ORPHAN_GRACE:
+                    image_batch.append((entry.name, st.st_size))
+
+                if len(temp_batch) >= UPLOAD_GC_BATCH_SIZE:
+                    _collect_temp(db, upload_dir, temp_batch, stats, dry_run)
+                    temp_batch = []
+                if len(image_batch) >= UPLOAD_GC_BATCH_SIZE:
+                    _collect_images(db, upload_dir, image_batch, stats, dry_run)
+                    image_batch = []
+        if temp_batch:
+            _collect_temp(db, upload_dir, temp_batch, stats, dry_run)
+        if image_batch:
+            _collect_images(db, upload_dir, image_batch, stats, dry_run)
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["files_per_second"] = round(stats["scanned"] / elapsed) if elapsed > 0 else 0
+    logger.info("Upload GC finished", extra={**stats, "dry_run": dry_run})
+    return stats
+
+
+def _collect_temp(db, upload_dir: str, batch: list[tuple[str, int]], stats: dict, dry_run: bool):
+    # upload_jobs.temp_path is stored as os.path.join(UPLOAD_DIR, name)
+    paths = {os.path.join(upload_dir, name): size for name, size in batch}
+    keep = referenced_temp_paths(db, list(paths))
+    for path, size in paths.items():
+        if path not in keep and _remove(path, dry_run, stats):
+            stats["temp_removed"] += 1
+            stats["bytes_freed"] += size
+            if not dry_run:
+                UPLOAD_GC_REMOVED.inc(kind="temp")
+                UPLOAD_GC_REMOVED_BYTES.inc(size)
+
+
+def _collect_images(db, upload_dir: str, batch: list[tuple[str, int]], stats: dict, dry_run: bool):
+    urls = {f"/uploads/{name}": (name, size) for name, size in batch}
+    keep = referenced_image_urls(db, list(urls))
+    for url, (name, size) in urls.items():
+        if url not in keep and _remove(os.path.join(upload_dir, name), dry_run, stats):
+            stats["orphans_removed"] += 1
+            stats["bytes_freed"] += size
+            if not dry_run:
+                UPLOAD_GC_REMOVED.inc(kind="orphan")
+                UPLOAD_GC_REMOVED_BYTES.inc(size)
+
+
+def _remove(path: str, dry_run: bool, stats: dict) -> bool:
+    if dry_run:
+        logger.info("Would remove %s", path)
+        return True
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        stats["errors"] += 1
+        logger.warning("Could not remove %s: %s", path, e)
+        return False
+
+
+class Collector:
+    """Runs collect() every `interval` seconds in a daemon thread"""
+
+    def __init__(self, upload_dir: str = "uploads", interval: float = UPLOAD_GC_INTERVAL):
+        self.upload_dir = upload_dir
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="upload-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                collect(self.upload_dir)
+            except Exception:
+                logger.exception("Upload GC failed")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "run":
+        logging_config.configure_logging()
+        result = collect(dry_run="--dry-run" in sys.argv[2:])
+        prefix = "Would remove" if "--dry-run" in sys.argv[2:] else "Removed"
+        print(
+            f"Scanned {result['scanned']} files in {result['seconds']}s ({result['files_per_second']} files/s). "
+            f"{prefix} {result['temp_removed']} temp files and {result['orphans_removed']} orphaned images "
+            f"({result['bytes_freed'] / 1024 / 1024:.1f} MB), {result['errors']} errors"
+        )
+    elif command == "loop":
+        logging_config.configure_logging()
+        interval = UPLOAD_GC_INTERVAL if UPLOAD_GC_INTERVAL > 0 else 3600
+        Collector(interval=interval).run_forever()
+    else:
+        print("Usage: python upload_gc.py run [--dry-run] | loop")
+        sys.exit(1)